@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""End to end benchmark of rancher-cli.py actions against benchmarks/mock_rancher.py.
+
+Starts a fake Rancher per project size, runs every case --runs times and reports
+api requests and bytes per run (from mock /_stats) and wall time percentiles.
+Results are compared with --baseline: failed runs, requests or bytes over
+--tolerance and p95 over --latencyTolerance are regressions and exit 1.
+--update writes results to baseline.
+
+Usage:
+    api_suite.py --sizes 10,100,1000 --runs 3
+    api_suite.py --sizes 10,100 --update
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import urllib2
+from time import sleep, time
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+_CLI = os.path.join(os.path.dirname(_DIR), 'rancher-cli.py')
+_MOCK = os.path.join(_DIR, 'mock_rancher.py')
+
+# Case name, rancher-cli.py arguments. {run} is run number, {tmp} is files directory
+CASES = [
+    ('get-svc-id', ['--action', 'get-svc-id', '--host', 'svc3.stack0']),
+    ('get-service-port', ['--action', 'get-service-port', '--host', 'svc3.stack0']),
+    ('get-container-id', ['--action', 'get-container-id', '--host', 'svc3.stack0']),
+    ('get-host-ip', ['--action', 'get-host-ip', '--host', 'svc3.stack0']),
+    ('get-instances', ['--action', 'get-instances',
+                       '--host', 'svc1.stack0,svc2.stack0,svc3.stack0']),
+    ('get-port', ['--action', 'get-port', '--portRangeStart', '20000',
+                  '--portRangeEnd', '40000', '--count', '3']),
+    ('get-host-port', ['--action', 'get-host-port', '--portRangeStart', '20000',
+                       '--portRangeEnd', '21000', '--count', '3']),
+    ('inventory', ['--action', 'inventory']),
+    ('add-link', ['--action', 'add-link', '--host', 'svc4.stack0',
+                  '--externalPort', '81', '--internalPort', '8080']),
+    ('remove-link', ['--action', 'remove-link', '--host', 'svc4.stack0',
+                     '--externalPort', '81']),
+    ('update-links add', ['--action', 'update-links', '--data', json.dumps(
+        {'add': [{'host': 'svc5.stack0', 'externalPort': 82, 'internalPort': 8080},
+                 {'host': 'svc6.stack0', 'externalPort': 82, 'internalPort': 8080}]})]),
+    ('update-links remove', ['--action', 'update-links', '--data', json.dumps(
+        {'remove': [{'host': 'svc5.stack0', 'externalPort': 82},
+                    {'host': 'svc6.stack0', 'externalPort': 82}]})]),
+    ('update-lb', ['--action', 'update-lb', '--data', '{"description": "benchmark"}']),
+    ('create-stack', ['--action', 'create-stack', '--stackName', 'bench{run}',
+                      '--dockerCompose', '{tmp}/docker-compose-{run}.yml']),
+    ('upgrade-stack', ['--action', 'create-stack', '--stackName', 'stack0',
+                       '--dockerCompose', '{tmp}/docker-compose-{run}.yml']),
+    ('upgrade-stack unchanged', ['--action', 'create-stack', '--stackName', 'stack0',
+                                 '--dockerCompose', '{tmp}/docker-compose-0.yml']),
+    ('upgrade-service', ['--action', 'upgrade-service', '--host', 'svc7.stack0',
+                         '--intervalMillis', '0']),
+    ('upgrade-services', ['--action', 'upgrade-services', '--selector', 'stack=stack0',
+                          '--intervalMillis', '0', '--workers', '4']),
+    ('remove-stack', ['--action', 'remove-stack', '--stackName', 'bench{run}']),
+    ('deploy', ['--action', 'deploy', '--manifest', '{tmp}/manifest-{run}.yml']),
+]
+
+
+def percentile(values, rank):
+    """Nearest rank percentile"""
+    values = sorted(values)
+    return values[max(0, int(round(rank / 100.0 * len(values) + 0.5)) - 1)]
+
+
+def write_files(directory, runs):
+    """Compose files and deploy manifests, distinct per run"""
+
+    for run in range(runs):
+        with open(os.path.join(directory, 'docker-compose-{}.yml'.format(run)), 'w') as output:
+            output.write('version: "2"\nservices:\n  web:\n    image: nginx\n'
+                         '    labels: {{run: "{}"}}\n'.format(run))
+        with open(os.path.join(directory, 'manifest-{}.yml'.format(run)), 'w') as output:
+            output.write('stacks:\n'
+                         '  - {{name: deploy{0}a, dockerCompose: docker-compose-{0}.yml}}\n'
+                         '  - {{name: deploy{0}b, dockerCompose: docker-compose-{0}.yml,'
+                         ' dependsOn: [deploy{0}a]}}\n'.format(run))
+
+
+class Mock(object):
+    """mock_rancher.py process"""
+
+    def __init__(self, port, services, latency):
+        self.url = 'http://127.0.0.1:{}'.format(port)
+        self.process = subprocess.Popen(
+            [sys.executable, _MOCK, '--port', str(port), '--services', str(services),
+             '--latency', str(latency), '--transitionDelay', '0.05'],
+            stdout=open(os.devnull, 'w'))
+        deadline = time() + 60
+        while True:
+            try:
+                self.stats()
+                break
+            except (urllib2.URLError, IOError):
+                if time() > deadline or self.process.poll() is not None:
+                    self.stop()
+                    raise RuntimeError('Fake Rancher did not start')
+                sleep(0.1)
+
+    def stats(self, reset=False):
+        """Get request stats, optionally resetting them"""
+        data = '' if reset else None
+        return json.loads(urllib2.urlopen(self.url + '/_stats', data, timeout=5).read())
+
+    def stop(self):
+        """Stop process"""
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+
+def run_case(mock, cli_args, runs, directory):
+    """Run case runs times. Returns per run requests, bytes and wall time percentiles"""
+
+    common = ['--apiUrl', mock.url, '--apiKey', 'key', '--apiSecret', 'secret',
+              '--projectId', '1a5', '--loadBalancerId', '1s1', '--nameCacheTtl', '0',
+              '--noDaemon']
+    mock.stats(reset=True)
+    durations = []
+    failed = 0
+    for run in range(runs):
+        args = [arg.replace('{run}', str(run)).replace('{tmp}', directory) for arg in cli_args]
+        started = time()
+        code = subprocess.call([sys.executable, _CLI] + common + args,
+                               stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+        durations.append(time() - started)
+        failed += 1 if code else 0
+    stats = mock.stats()
+    return {'requests': float(stats['requests']) / runs,
+            'bytes': float(stats['bytesIn'] + stats['bytesOut']) / runs,
+            'p50': percentile(durations, 50), 'p95': percentile(durations, 95),
+            'failed': failed}
+
+
+def regressions(results, baseline, tolerance, latency_tolerance):
+    """Describe results worse than baseline"""
+
+    found = []
+    for key, result in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if result['failed'] > base.get('failed', 0):
+            found.append('{}: {} failed runs'.format(key, result['failed']))
+        if result['requests'] > base['requests'] * (1 + tolerance):
+            found.append('{}: requests {:.1f} > {:.1f}'.format(
+                key, result['requests'], base['requests']))
+        if result['bytes'] > base['bytes'] * (1 + tolerance):
+            found.append('{}: bytes {:.0f} > {:.0f}'.format(key, result['bytes'], base['bytes']))
+        if result['p95'] > base['p95'] * (1 + latency_tolerance):
+            found.append('{}: p95 {:.0f}ms > {:.0f}ms'.format(
+                key, result['p95'] * 1000, base['p95'] * 1000))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rancher-cli.py end to end benchmark')
+    parser.add_argument('--sizes', default='10,100,1000',
+                        help='Comma separated project sizes in services. Default 10,100,1000')
+    parser.add_argument('--runs', type=int, default=3, help='Runs per case. Default 3')
+    parser.add_argument('--cases', default=None,
+                        help='Comma separated case names. Default all')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Fake api response delay in seconds. Default 0')
+    parser.add_argument('--port', type=int, default=18080, help='Fake api port. Default 18080')
+    parser.add_argument('--baseline', default=os.path.join(_DIR, 'baseline.json'),
+                        help='Baseline results file. Default benchmarks/baseline.json')
+    parser.add_argument('--update', action='store_true', help='Write results to baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed requests and bytes growth ratio. Default 0.1')
+    parser.add_argument('--latencyTolerance', type=float, default=1.0,
+                        help='Allowed p95 growth ratio. Default 1.0')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    names = args.cases.split(',') if args.cases else None
+    cases = [(name, cli_args) for name, cli_args in CASES if names is None or name in names]
+    directory = tempfile.mkdtemp(prefix='rancher-bench-')
+    write_files(directory, args.runs)
+    results = {}
+    try:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            mock = Mock(args.port, size, args.latency)
+            try:
+                for name, cli_args in cases:
+                    results['{}/{}'.format(size, name)] = run_case(
+                        mock, cli_args, args.runs, directory)
+            finally:
+                mock.stop()
+    finally:
+        shutil.rmtree(directory)
+
+    if args.json:
+        print json.dumps(results, indent=2, sort_keys=True)
+    else:
+        print '{:<28} {:>9} {:>10} {:>9} {:>9} {:>7}'.format(
+            'size/case', 'requests', 'bytes', 'p50', 'p95', 'failed')
+        for size in args.sizes.split(','):
+            for name, _ in cases:
+                result = results['{}/{}'.format(int(size), name)]
+                print '{:<28} {:>9.1f} {:>10.0f} {:>7.0f}ms {:>7.0f}ms {:>7}'.format(
+                    '{}/{}'.format(int(size), name), result['requests'], result['bytes'],
+                    result['p50'] * 1000, result['p95'] * 1000, result['failed'])
+
+    if args.update:
+        baseline = {}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline) as input_file:
+                baseline = json.load(input_file)
+        baseline.update(results)
+        with open(args.baseline, 'w') as output:
+            json.dump(baseline, output, indent=2, sort_keys=True)
+            output.write('\n')
+        return
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as input_file:
+            baseline = json.load(input_file)
+    found = regressions(results, baseline, args.tolerance, args.latencyTolerance)
+    for regression in found:
+        sys.stderr.write('Regression: {}\n'.format(regression))
+    exit(1 if found else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Local stand-in for Rancher event stream (/subscribe websocket).
+Replays recorded events to each client, then closes the connection.
+
+Recording is a JSON lines file, one event per line. Optional "delay" key
+holds seconds to sleep before sending the event:
+
+{"delay": 1, "name": "resource.change", "resourceId": "1s5", "data": {"resource": {...}}}
+
+Usage:
+    event_replay.py recording.jsonl --port 8081
+    rancher-cli.py --waitEvents --eventsUrl ws://127.0.0.1:8081/ ...
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import struct
+import SocketServer
+from time import sleep
+
+_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def load_events(path):
+    """Load recorded events"""
+    with open(path) as file_object:
+        return [json.loads(line) for line in file_object if line.strip()]
+
+
+def frame(text, opcode=0x1):
+    """Unmasked server websocket frame"""
+
+    length = len(text)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + text
+
+
+class ReplayHandler(SocketServer.StreamRequestHandler):
+    """Websocket handshake and events replay"""
+
+    def handle(self):
+        key = None
+        while True:
+            line = self.rfile.readline().strip()
+            if not line:
+                break
+            if line.lower().startswith('sec-websocket-key:'):
+                key = line.split(':', 1)[1].strip()
+        if key is None:
+            return
+
+        accept = base64.b64encode(hashlib.sha1(key + _GUID).digest())
+        self.wfile.write('HTTP/1.1 101 Switching Protocols\r\n'
+                         'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                         'Sec-WebSocket-Accept: {}\r\n\r\n'.format(accept))
+        for event in self.server.events:
+            event = dict(event)
+            sleep(float(event.pop('delay', 0)))
+            self.wfile.write(frame(json.dumps(event)))
+            self.wfile.flush()
+        if not self.server.keep_open:
+            self.wfile.write(frame('', 0x8))
+            return
+        self.rfile.read()
+
+
+class ReplayServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """Threaded replay server"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, events, keep_open=False):
+        SocketServer.TCPServer.__init__(self, address, ReplayHandler)
+        self.events = events
+        self.keep_open = keep_open
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rancher event stream stand-in')
+    parser.add_argument('recording', help='JSON lines file with recorded events')
+    parser.add_argument('--port', type=int, default=8081, help='Listen port. Default 8081')
+    parser.add_argument('--keepOpen', action='store_true',
+                        help='Keep connection open after replay instead of dropping it')
+    args = parser.parse_args()
+
+    server = ReplayServer(('127.0.0.1', args.port), load_events(args.recording), args.keepOpen)
+    print 'Replaying {} events on ws://127.0.0.1:{}/'.format(len(server.events), args.port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+"""Local fake Rancher v1/v2-beta API server.
+
+Serves environments (stacks), services, loadbalancerservices,
+serviceconsumemaps, hosts and containers from memory with scripted
+state transitions: upgrade, finishupgrade and create move resources
+through transitioning states for --transitionDelay seconds. Each
+response can be delayed by --latency seconds.
+
+GET responses carry an ETag of their body, If-None-Match with it gets 304.
+--failureRate part of api requests is answered 503 without being handled.
+
+GET /_stats returns request counts and bytes in/out, POST /_stats resets
+them.
+
+Usage:
+    mock_rancher.py --port 8080 --services 100
+    rancher-cli.py --apiUrl http://127.0.0.1:8080 --projectId 1a5 ...
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from time import sleep, time
+
+PROJECT_ID = '1a5'
+LB_ID = '1s1'
+TCP_LB_ID = '1s2'
+
+
+class State(object):
+    """Fake Rancher project state"""
+
+    def __init__(self, services=10, hosts=3, transition_delay=1.0):
+        self.lock = threading.RLock()
+        self.transition_delay = transition_delay
+        self.next_id = 1000
+        self.stacks = {}
+        self.services = {}
+        self.maps = {}
+        self.hosts = {}
+        self.containers = {}
+        self.transitions = []
+        self.stats = {'requests': 0, 'bytesIn': 0, 'bytesOut': 0, 'endpoints': {}}
+        self.__populate(services, hosts)
+
+    def new_id(self, prefix):
+        """Allocate resource id"""
+        with self.lock:
+            self.next_id += 1
+            return '1{}{}'.format(prefix, self.next_id)
+
+    def __populate(self, services, hosts):
+        for index in range(hosts):
+            host_id = '1h{}'.format(index + 1)
+            self.hosts[host_id] = {
+                'id': host_id, 'type': 'host', 'state': 'active',
+                'name': 'host{}'.format(index + 1),
+                'agentIpAddress': '10.0.0.{}'.format(index + 1), 'publicEndpoints': []}
+
+        system = self.add_stack('system', '', '')
+        self.add_service(system['id'], 'http-lb', LB_ID, lb_config={'portRules': []},
+                         kind='loadBalancerService')
+        self.add_service(system['id'], 'tcp-lb', TCP_LB_ID, lb_config={'portRules': []},
+                         kind='loadBalancerService')
+        stack = None
+        for index in range(services):
+            if index % 10 == 0:
+                stack = self.add_stack('stack{}'.format(index / 10), 'version: "2"\n', '')
+            service = self.add_service(stack['id'], 'svc{}'.format(index))
+            port = 20000 + index
+            self.add_link(LB_ID, service['id'],
+                          ['svc{}.stack{}.example.com:80={}'.format(index, index / 10, port)])
+            tcp_port = 30000 + index
+            self.services[TCP_LB_ID]['lbConfig']['portRules'].append({
+                'protocol': 'tcp', 'type': 'portRule', 'priority': 1,
+                'sourcePort': tcp_port, 'targetPort': port, 'serviceId': service['id']})
+            host = self.hosts['1h{}'.format(index % hosts + 1)]
+            host['publicEndpoints'].append({
+                'ipAddress': host['agentIpAddress'], 'port': port,
+                'serviceId': service['id'], 'hostId': host['id']})
+
+    def add_stack(self, name, docker_compose, rancher_compose):
+        """Add active healthy stack"""
+        number = self.new_id('st')[3:]
+        stack = {'id': '1st' + number, 'type': 'stack', 'name': name, 'state': 'active',
+                 'healthState': 'healthy', 'dockerCompose': docker_compose,
+                 'rancherCompose': rancher_compose, 'removed': None}
+        self.stacks[stack['id']] = stack
+        return stack
+
+    def add_service(self, stack_id, name, service_id=None, lb_config=None, kind='service'):
+        """Add active healthy service with one container"""
+        service_id = service_id or self.new_id('s')
+        service = {'id': service_id, 'type': kind, 'name': name, 'stackId': stack_id,
+                   'environmentId': stack_id.replace('st', 'e'), 'state': 'active',
+                   'healthState': 'healthy', 'removed': None,
+                   'launchConfig': {'imageUuid': 'docker:nginx', 'ports': []}}
+        if lb_config is not None:
+            service['lbConfig'] = lb_config
+        self.services[service_id] = service
+        host_ids = sorted(self.hosts.keys())
+        container_id = self.new_id('i')
+        self.containers[container_id] = {
+            'id': container_id, 'type': 'container', 'name': name + '-1',
+            'serviceId': service_id, 'state': 'running', 'healthState': 'healthy',
+            'startCount': 1, 'externalId': 'c0ffee' + container_id,
+            'hostId': host_ids[len(self.containers) % len(host_ids)] if host_ids else None}
+        return service
+
+    def add_link(self, lb_id, service_id, ports):
+        """Add service consume map"""
+        map_id = self.new_id('sc')
+        self.maps[map_id] = {'id': map_id, 'type': 'serviceConsumeMap', 'serviceId': lb_id,
+                             'consumedServiceId': service_id, 'ports': ports,
+                             'state': 'active', 'removed': None}
+
+    def transition(self, resource, steps):
+        """Schedule resource field changes: [(delay multiplier, field, value)]"""
+        now = time()
+        for delay, field, value in steps:
+            self.transitions.append((now + delay * self.transition_delay, resource, field, value))
+
+    def apply_transitions(self):
+        """Apply due transitions"""
+        now = time()
+        with self.lock:
+            due = [item for item in self.transitions if item[0] <= now]
+            self.transitions = [item for item in self.transitions if item[0] > now]
+            for _, resource, field, value in sorted(due, key=lambda item: item[0]):
+                resource[field] = value
+
+
+def collection(items, query, base_url):
+    """Filtered, marker paginated collection"""
+
+    items = sorted(items, key=lambda item: item['id'])
+    for key, values in query.items():
+        if key in ('limit', 'marker', 'include'):
+            continue
+        if key.endswith('_null'):
+            items = [item for item in items if item.get(key[:-5]) is None]
+        else:
+            items = [item for item in items if str(item.get(key)) == values[0]]
+
+    limit = int(query.get('limit', ['100'])[0])
+    start = int(query.get('marker', ['0'])[0])
+    page = items[start:] if limit < 0 else items[start:start + limit]
+    next_url = None
+    if limit >= 0 and start + limit < len(items):
+        params = dict((key, values[0]) for key, values in query.items())
+        params['marker'] = str(start + limit)
+        next_url = '{}?{}'.format(base_url, '&'.join(
+            '{}={}'.format(key, value) for key, value in sorted(params.items())))
+    return {'type': 'collection', 'data': page,
+            'pagination': {'limit': limit, 'next': next_url, 'partial': next_url is not None}}
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Fake Rancher API request handler"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def __send(self, status, body, headers=None):
+        data = json.dumps(body)
+        etag = '"{}"'.format(hashlib.md5(data).hexdigest())
+        if status == 200 and self.command == 'GET' and self.headers.get('If-None-Match') == etag:
+            status, data = 304, ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if self.command == 'GET' and status == 200:
+            self.send_header('ETag', etag)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        with self.server.state.lock:
+            self.server.state.stats['bytesOut'] += len(data)
+
+    def __handle(self, method):
+        state = self.server.state
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        url = urlparse.urlparse(self.path)
+        path = url.path.strip('/')
+        query = urlparse.parse_qs(url.query, keep_blank_values=True)
+        if path == '_stats':
+            if method == 'POST':
+                state.stats = {'requests': 0, 'bytesIn': 0, 'bytesOut': 0, 'endpoints': {}}
+            return self.__send(200, state.stats)
+
+        sleep(self.server.latency)
+        if random.random() < self.server.failure_rate:
+            with state.lock:
+                state.stats['failed'] = state.stats.get('failed', 0) + 1
+            return self.__send(503, {'type': 'error', 'status': 503, 'code': 'Unavailable'},
+                               {'Retry-After': '0'})
+        state.apply_transitions()
+        for route_method, pattern, handler in ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match:
+                template = '{} {}'.format(method, pattern.pattern)
+                with state.lock:
+                    state.stats['requests'] += 1
+                    state.stats['bytesIn'] += len(body)
+                    endpoints = state.stats['endpoints']
+                    endpoints[template] = endpoints.get(template, 0) + 1
+                    payload = json.loads(body) if body else {}
+                    base_url = 'http://{}/{}'.format(self.headers.get('Host'), path)
+                    status, response = handler(state, match, query, payload, base_url)
+                return self.__send(status, response)
+        return self.__send(404, {'type': 'error', 'status': 404, 'code': 'NotFound'})
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """GET"""
+        self.__handle('GET')
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """POST"""
+        self.__handle('POST')
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        """PUT"""
+        self.__handle('PUT')
+
+
+def __not_found():
+    return 404, {'type': 'error', 'status': 404, 'code': 'NotFound'}
+
+
+def __stack(state, stack_id):
+    return state.stacks.get(stack_id.replace('1e', '1st', 1))
+
+
+def list_stacks(state, _, query, __, base_url):
+    """GET environments"""
+    return 200, collection(state.stacks.values(), query, base_url)
+
+
+def get_stack(state, match, *_):
+    """GET environments/{id}"""
+    stack = __stack(state, match.group(1))
+    return (200, stack) if stack else __not_found()
+
+
+def create_stack(state, _, __, payload, ___):
+    """POST stack"""
+    for stack in state.stacks.values():
+        if stack['name'] == payload.get('name') and stack['removed'] is None:
+            return 422, {'type': 'error', 'status': 422, 'code': 'NotUnique',
+                         'fieldName': 'name'}
+    stack = state.add_stack(payload['name'], payload.get('dockerCompose', ''),
+                            payload.get('rancherCompose', ''))
+    stack.update({'state': 'activating', 'healthState': 'initializing'})
+    state.transition(stack, [(1, 'state', 'active'), (2, 'healthState', 'healthy')])
+    return 201, stack
+
+
+def stack_action(state, match, query, payload, _):
+    """POST environments/{id}/?action="""
+    stack = __stack(state, match.group(1))
+    if stack is None:
+        return __not_found()
+    action = query.get('action', [''])[0]
+    if action == 'upgrade':
+        stack.update({'state': 'upgrading', 'dockerCompose': payload.get('dockerCompose'),
+                      'rancherCompose': payload.get('rancherCompose')})
+        state.transition(stack, [(1, 'state', 'upgraded')])
+    elif action == 'finishupgrade':
+        stack.update({'state': 'finishing-upgrade', 'healthState': 'initializing'})
+        state.transition(stack, [(1, 'state', 'active'), (1, 'healthState', 'healthy')])
+    elif action == 'remove':
+        stack.update({'state': 'removed', 'removed': time()})
+    return 202, stack
+
+
+def list_stack_services(state, match, query, _, base_url):
+    """GET environments/{id}/services"""
+    stack = __stack(state, match.group(1))
+    if stack is None:
+        return __not_found()
+    services = [service for service in state.services.values()
+                if service['stackId'] == stack['id']]
+    return 200, collection(services, query, base_url)
+
+
+def get_service(state, match, *_):
+    """GET services/{id}, loadbalancerservices/{id}"""
+    service = state.services.get(match.group(1))
+    return (200, service) if service else __not_found()
+
+
+def list_instances(state, match, query, _, base_url):
+    """GET services/{id}/instances, include=hosts embeds instance host"""
+    containers = [container for container in state.containers.values()
+                  if container['serviceId'] == match.group(1)]
+    if 'hosts' in query.get('include', []):
+        containers = [dict(container, hosts=[state.hosts[container['hostId']]]
+                           if container['hostId'] in state.hosts else [])
+                      for container in containers]
+    return 200, collection(containers, query, base_url)
+
+
+def service_action(state, match, query, payload, _):
+    """POST services/{id}/?action="""
+    service = state.services.get(match.group(1))
+    if service is None:
+        return __not_found()
+    action = query.get('action', [''])[0]
+    if action == 'upgrade':
+        strategy = payload.get('inServiceStrategy') or {}
+        if strategy.get('launchConfig'):
+            service['launchConfig'] = strategy['launchConfig']
+        service['state'] = 'upgrading'
+        state.transition(service, [(1, 'state', 'upgraded')])
+    elif action == 'finishupgrade':
+        service['state'] = 'finishing-upgrade'
+        state.transition(service, [(1, 'state', 'active')])
+    elif action == 'setservicelinks':
+        for item in state.maps.values():
+            if item['serviceId'] == service['id'] and item['removed'] is None:
+                item.update({'state': 'removed', 'removed': time()})
+        for link in payload.get('serviceLinks') or []:
+            state.add_link(service['id'], link['serviceId'], link.get('ports'))
+    elif action == 'update':
+        service['state'] = 'updating-active'
+        state.transition(service, [(0.2, 'state', 'active')])
+    return 202, service
+
+
+def update_lb(state, match, _, payload, __):
+    """PUT projects/{id}/loadbalancerservices/{id}"""
+    service = state.services.get(match.group(1))
+    if service is None:
+        return __not_found()
+    service.update(payload)
+    return 200, service
+
+
+def consumed_services(state, match, query, _, base_url):
+    """GET loadbalancerservices/{id}/consumedservices"""
+    ids = set(item['consumedServiceId'] for item in state.maps.values()
+              if item['serviceId'] == match.group(1) and item['removed'] is None)
+    return 200, collection([state.services[item] for item in ids], query, base_url)
+
+
+def list_maps(state, _, query, __, base_url):
+    """GET serviceconsumemaps"""
+    return 200, collection(state.maps.values(), query, base_url)
+
+
+def list_hosts(state, _, query, __, base_url):
+    """GET hosts"""
+    return 200, collection(state.hosts.values(), query, base_url)
+
+
+def get_host(state, match, *_):
+    """GET hosts/{id}"""
+    host = state.hosts.get(match.group(1))
+    return (200, host) if host else __not_found()
+
+
+def list_containers(state, _, query, __, base_url):
+    """GET containers"""
+    return 200, collection(state.containers.values(), query, base_url)
+
+
+def get_container(state, match, *_):
+    """GET containers/{id}"""
+    container = state.containers.get(match.group(1))
+    return (200, container) if container else __not_found()
+
+
+_ID = '([0-9a-z]+)'
+_VERSION = '(?:v1|v2-beta)'
+ROUTES = [
+    ('GET', re.compile('^{}/environments$'.format(_VERSION)), list_stacks),
+    ('GET', re.compile('^{}/environments/{}$'.format(_VERSION, _ID)), get_stack),
+    ('GET', re.compile('^{}/stacks/{}$'.format(_VERSION, _ID)), get_stack),
+    ('POST', re.compile('^{}/projects/{}/stacks?$'.format(_VERSION, _ID[1:-1])), create_stack),
+    ('POST', re.compile('^{}/environments/{}$'.format(_VERSION, _ID)), stack_action),
+    ('GET', re.compile('^{}/environments/{}/services$'.format(_VERSION, _ID)),
+     list_stack_services),
+    ('GET', re.compile('^{}/(?:services|loadbalancerservices)/{}$'.format(_VERSION, _ID)),
+     get_service),
+    ('GET', re.compile('^{}/services/{}/instances$'.format(_VERSION, _ID)), list_instances),
+    ('POST', re.compile('^{}/(?:services|loadbalancerservices)/{}$'.format(_VERSION, _ID)),
+     service_action),
+    ('PUT', re.compile('^{}/projects/{}/loadbalancerservices/{}$'.format(
+        _VERSION, _ID[1:-1], _ID)), update_lb),
+    ('GET', re.compile('^{}/loadbalancerservices/{}/consumedservices$'.format(_VERSION, _ID)),
+     consumed_services),
+    ('GET', re.compile('^{}/serviceconsumemaps$'.format(_VERSION)), list_maps),
+    ('GET', re.compile('^{}/hosts$'.format(_VERSION)), list_hosts),
+    ('GET', re.compile('^{}/hosts/{}$'.format(_VERSION, _ID)), get_host),
+    ('GET', re.compile('^{}/containers$'.format(_VERSION)), list_containers),
+    ('GET', re.compile('^{}/containers/{}$'.format(_VERSION, _ID)), get_container),
+]
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    """Threaded fake Rancher API server"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, state, latency=0.0, failure_rate=0.0):
+        HTTPServer.__init__(self, address, Handler)
+        self.state = state
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Rancher API server')
+    parser.add_argument('--port', type=int, default=8080, help='Listen port. Default 8080')
+    parser.add_argument('--services', type=int, default=10,
+                        help='Services count, 10 per stack. Default 10')
+    parser.add_argument('--hosts', type=int, default=3, help='Hosts count. Default 3')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Response delay in seconds. Default 0')
+    parser.add_argument('--transitionDelay', type=float, default=1.0,
+                        help='Seconds per scripted state transition. Default 1')
+    parser.add_argument('--failureRate', type=float, default=0.0,
+                        help='Part of requests answered 503, 0..1. Default 0')
+    args = parser.parse_args()
+
+    state = State(args.services, args.hosts, args.transitionDelay)
+    server = MockServer(('127.0.0.1', args.port), state, args.latency, args.failureRate)
+    print 'Fake Rancher API on http://127.0.0.1:{}, project {}, load balancers {} {}'.format(
+        args.port, PROJECT_ID, LB_ID, TCP_LB_ID)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
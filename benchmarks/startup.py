@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""rancher-cli.py startup benchmark.
+Runs --help, a rejected action and every action in fresh interpreters and reports
+wall time, time spent importing and loaded modules. Exits 1 when over budget.
+
+Actions run against --apiUrl, by default a closed local port, so they fail on their
+first api call, which is not retried, and measure startup only. Point it to benchmarks/mock_rancher.py to
+time whole actions.
+
+Usage:
+    startup.py --runs 5 --helpBudget 150 --importBudget 250
+"""
+
+import __builtin__
+import argparse
+import json
+import os
+import runpy
+import subprocess
+import sys
+from time import time
+
+_CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rancher-cli.py')
+
+_COMMON_ARGS = ['--apiKey', 'key', '--apiSecret', 'secret', '--projectId', '1a5',
+                '--loadBalancerId', '1s1', '--nameCacheTtl', '0', '--noDaemon',
+                '--retries', '0']
+
+# Minimal arguments each action needs to reach its first api call
+ACTION_ARGS = {
+    'add-link': ['--host', 'svc.stack', '--externalPort', '80', '--internalPort', '8080'],
+    'remove-link': ['--host', 'svc.stack', '--externalPort', '80'],
+    'create-stack': ['--stackName', 'stack', '--dockerCompose', os.devnull],
+    'remove-stack': ['--stackName', 'stack'],
+    'get-port': ['--portRangeStart', '3000', '--portRangeEnd', '4000'],
+    'get-service-port': ['--host', 'svc.stack'],
+    'update-lb': ['--data', '{}'],
+    'get-svc-id': ['--host', 'svc.stack'],
+    'get-container-id': ['--serviceId', '1s5'],
+    'get-host-ip': ['--serviceId', '1s5'],
+    'deploy': ['--manifest', os.devnull],
+    'update-links': ['--data', '{"add": [], "remove": []}'],
+    'get-host-port': ['--portRangeStart', '20000', '--portRangeEnd', '21000'],
+    'inventory': [],
+    'get-instances': ['--serviceId', '1s5'],
+}
+
+
+def child(cli_args):
+    """Run rancher-cli.py in this interpreter and print its startup metrics"""
+
+    started = time()
+    spent = {'imports': 0.0, 'depth': 0}
+    original_import = __builtin__.__import__
+
+    def timed_import(*args, **kwargs):
+        spent['depth'] += 1
+        import_started = time()
+        try:
+            return original_import(*args, **kwargs)
+        finally:
+            spent['depth'] -= 1
+            if not spent['depth']:
+                spent['imports'] += time() - import_started
+
+    __builtin__.__import__ = timed_import
+    stdout = sys.stdout
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+    sys.argv = [_CLI] + cli_args
+    sys.path.insert(0, os.path.dirname(_CLI))
+    try:
+        runpy.run_path(_CLI, run_name='__main__')
+    except BaseException:  # pylint: disable=broad-except
+        pass  # failures past startup are expected
+    finally:
+        __builtin__.__import__ = original_import
+        sys.stdout = stdout
+    print json.dumps({'wall': time() - started, 'imports': spent['imports'],
+                      'modules': len([name for name, module in sys.modules.items() if module]),
+                      'requests': 'requests' in sys.modules})
+
+
+def measure(cli_args, runs):
+    """Median metrics of runs fresh interpreters"""
+
+    samples = []
+    for _ in range(runs):
+        started = time()
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                          '--child', '--'] + cli_args)
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample['process'] = time() - started
+        samples.append(sample)
+    result = {}
+    for key in ('process', 'wall', 'imports', 'modules'):
+        values = sorted(sample[key] for sample in samples)
+        result[key] = values[len(values) / 2]
+    result['requests'] = samples[-1]['requests']
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rancher-cli.py startup benchmark')
+    parser.add_argument('--runs', type=int, default=5, help='Runs per case. Default 5')
+    parser.add_argument('--apiUrl', default='http://127.0.0.1:9',
+                        help='api url for actions. Default is a closed local port')
+    parser.add_argument('--helpBudget', type=float, default=150,
+                        help='Max --help process time, ms. Default 150')
+    parser.add_argument('--importBudget', type=float, default=250,
+                        help='Max import time of any action, ms. Default 250')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('cli_args', nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.cli_args[1:] if args.cli_args[:1] == ['--'] else args.cli_args)
+        return
+
+    sys.path.insert(0, os.path.dirname(_CLI))
+    from rancher import actions
+
+    cases = [('--help', ['--help']), ('unknown action', ['--action', 'unknown'])]
+    for action in actions.ACTIONS:
+        cases.append((action, ['--action', action, '--apiUrl', args.apiUrl] + _COMMON_ARGS +
+                      ACTION_ARGS.get(action, [])))
+
+    results = {}
+    failures = []
+    for name, cli_args in cases:
+        result = measure(cli_args, args.runs)
+        results[name] = result
+        if name == '--help' and result['process'] * 1000 > args.helpBudget:
+            failures.append('--help takes {:.0f}ms'.format(result['process'] * 1000))
+        if name == '--help' and result['requests']:
+            failures.append('--help imports requests')
+        if result['imports'] * 1000 > args.importBudget:
+            failures.append('{} imports take {:.0f}ms'.format(name, result['imports'] * 1000))
+
+    if args.json:
+        print json.dumps(results, indent=2, sort_keys=True)
+    else:
+        print '{:<20} {:>10} {:>10} {:>10} {:>8} {:>9}'.format(
+            'case', 'process', 'main', 'imports', 'modules', 'requests')
+        for name, _ in cases:
+            result = results[name]
+            print '{:<20} {:>8.0f}ms {:>8.0f}ms {:>8.0f}ms {:>8} {:>9}'.format(
+                name, result['process'] * 1000, result['wall'] * 1000,
+                result['imports'] * 1000, result['modules'], 'yes' if result['requests'] else 'no')
+
+    for failure in failures:
+        sys.stderr.write('Over budget: {}\n'.format(failure))
+    exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,59 @@
 #!/usr/bin/python
 
 import argparse
+import atexit
 import json
 import os
+import sys
 
-from rancher import servicelink, service, stack, config, host
+from rancher import config, actions
+
+# Files of these params are opened by the action
+_PATH_PARAMS = ('dockerCompose', 'rancherCompose', 'manifest')
+
+
+def __print_connection_stats():
+    from rancher import http_util, resilience
+    sys.stderr.write('HTTP connections: {}\n'.format(json.dumps(http_util.connection_stats())))
+    sys.stderr.write('HTTP resilience: {}\n'.format(json.dumps(resilience.stats())))
+
+
+def __print_cache_stats():
+    from rancher import name_cache, memo, http_cache
+    sys.stderr.write('Name cache: {}\n'.format(json.dumps(name_cache.stats())))
+    sys.stderr.write('Request memo: {}\n'.format(json.dumps(memo.stats())))
+    sys.stderr.write('HTTP cache: {}\n'.format(json.dumps(http_cache.stats())))
+
+
+def __run_on_daemon(args):
+    """Run action on daemon and exit with its code. Returns if daemon can't serve it"""
+
+    if not os.path.exists(config.DAEMON_SOCKET):
+        return
+    from rancher import daemon
+    if args.action.lower() not in daemon.ACTIONS:
+        return
+    params = dict((name, value) for name, value in vars(args).items()
+                  if name not in ('apiKey', 'apiSecret'))
+    # Daemon runs in its own working directory
+    for name in _PATH_PARAMS:
+        if params.get(name):
+            params[name] = os.path.abspath(params[name])
+    response = daemon.call(config.DAEMON_SOCKET, daemon.scope(), params)
+    if response is None or response['code'] == daemon.REFUSED:
+        return
+    sys.stdout.write(response['output'])
+    if response['result'] is not None:
+        print response['result']
+    if response['error']:
+        sys.stderr.write('Daemon action failed: {}\n'.format(response['error']))
+    exit(response['code'])
+
+
+def __run_action(args):
+    result = actions.run(vars(args))
+    if result is not None:
+        print result
 
 
 def main():
@@ -34,24 +83,134 @@ def main():
     parser.add_argument('--stackHealthyTimeout', default=os.environ.get('STACK_HEALTHY_TIMEOUT', 360),
                         help='timeout for stack become healthy in seconds. Default 360')
 
+    parser.add_argument('--httpPoolSize', default=os.environ.get('RANCHER_HTTP_POOL_SIZE', 10),
+                        help='max keep-alive connections per host. Default 10')
+    parser.add_argument('--connectTimeout', default=os.environ.get('RANCHER_CONNECT_TIMEOUT', 10),
+                        help='api connect timeout in seconds. Default 10')
+    parser.add_argument('--readTimeout', default=os.environ.get('RANCHER_READ_TIMEOUT', 60),
+                        help='api read timeout in seconds. Default 60')
+    parser.add_argument('--httpCacheDir', default=os.environ.get('RANCHER_HTTP_CACHE_DIR'),
+                        help='keep api responses with ETag/Last-Modified in directory and '
+                        'revalidate them, $RANCHER_HTTP_CACHE_DIR environment variable can be '
+                        'used. Disabled by default')
+    parser.add_argument('--httpCacheSize', default=os.environ.get('RANCHER_HTTP_CACHE_SIZE', 50),
+                        help='max http cache directory size in megabytes. Default 50')
+    parser.add_argument('--rateLimit', default=os.environ.get('RANCHER_RATE_LIMIT', 0),
+                        help='max api requests per second of all threads, 0 is unlimited. '
+                        'Default 0')
+    parser.add_argument('--rateBurst', default=os.environ.get('RANCHER_RATE_BURST', 10),
+                        help='api requests sent at once before rate limit applies. Default 10')
+    parser.add_argument('--retries', default=os.environ.get('RANCHER_RETRIES', 3),
+                        help='retries of failed api request, POST only when it was not '
+                        'handled. Default 3')
+    parser.add_argument('--retryBackoff', default=os.environ.get('RANCHER_RETRY_BACKOFF', 0.5),
+                        help='first retry max pause in seconds, doubled each retry. Default 0.5')
+    parser.add_argument('--retryMaxBackoff',
+                        default=os.environ.get('RANCHER_RETRY_MAX_BACKOFF', 30),
+                        help='max retry pause in seconds. Default 30')
+    parser.add_argument('--circuitFailures', default=os.environ.get('RANCHER_CIRCUIT_FAILURES', 5),
+                        help='failed api requests in a row that stop requests for '
+                        '--circuitReset seconds, 0 disables. Default 5')
+    parser.add_argument('--circuitReset', default=os.environ.get('RANCHER_CIRCUIT_RESET', 30),
+                        help='seconds without requests after --circuitFailures. Default 30')
+    parser.add_argument('--connectionStats', action='store_true',
+                        help='print opened/reused api connections, rate limit waits, retries '
+                        'and circuit breaker counters to stderr on exit')
+    parser.add_argument('--unhealthyGrace', default=os.environ.get('RANCHER_UNHEALTHY_GRACE', 60),
+                        help='seconds a stack/service may stay unhealthy while waiting before '
+                        'failing. Default 60')
+    parser.add_argument('--restartLimit', default=os.environ.get('RANCHER_RESTART_LIMIT', 3),
+                        help='instance restarts while waiting treated as restart loop. Default 3')
+    parser.add_argument('--waitEvents', action='store_true',
+                        default=bool(os.environ.get('RANCHER_WAIT_EVENTS')),
+                        help='wait for stack/service state changes via api event stream '
+                        '(needs websocket-client), $RANCHER_WAIT_EVENTS environment variable '
+                        'can be used')
+    parser.add_argument('--eventsUrl', default=os.environ.get('RANCHER_EVENTS_URL'),
+                        help='event stream websocket url. Default is project subscribe url')
+    parser.add_argument('--concurrency', default=os.environ.get('RANCHER_CONCURRENCY', 8),
+                        help='max concurrent api requests for bulk fetches. Default 8')
+    parser.add_argument('--pageSize', default=os.environ.get('RANCHER_PAGE_SIZE', 100),
+                        help='api collection page size. Default 100')
+    parser.add_argument('--nameCacheFile',
+                        default=os.environ.get('RANCHER_NAME_CACHE_FILE',
+                                               os.path.expanduser('~/.rancher-cli/names.json')),
+                        help='stack/service id cache file, $RANCHER_NAME_CACHE_FILE environment '
+                        'variable can be used')
+    parser.add_argument('--nameCacheTtl', default=os.environ.get('RANCHER_NAME_CACHE_TTL', 0),
+                        help='stack/service id cache ttl in seconds, cached ids are not checked, '
+                        'so stacks recreated meanwhile are missed. Default 0, no cache')
+    parser.add_argument('--cacheStats', action='store_true',
+                        help='print stack/service id cache hits/misses and requests saved by '
+                        'request memo to stderr on exit')
+
+    parser.add_argument('--traceFile', default=os.environ.get('RANCHER_TRACE_FILE'),
+                        help='append api requests and wait phases to file as JSON lines')
+    parser.add_argument('--traceSummary', action='store_true',
+                        help='print api time per endpoint and wait time to stderr on exit')
+    parser.add_argument('--tracePrometheus', default=os.environ.get('RANCHER_TRACE_PROMETHEUS'),
+                        help='write api and wait metrics to prometheus textfile collector file '
+                        'on exit')
+
+    parser.add_argument('--profile', action='store_true',
+                        help='run action under profiler (never on daemon), write profile to '
+                        '--profileFile and print top functions to stderr')
+    parser.add_argument('--profileFile', default='rancher-cli.prof',
+                        help='profile output file. Default rancher-cli.prof')
+    parser.add_argument('--profiler', default='cprofile', choices=('cprofile', 'sample'),
+                        help='cprofile writes pstats, sample writes collapsed stacks for '
+                        'flame graphs. Default cprofile')
+
+    parser.add_argument('--daemonSocket',
+                        default=os.environ.get('RANCHER_DAEMON_SOCKET',
+                                               os.path.expanduser('~/.rancher-cli/daemon.sock')),
+                        help='daemon action socket, lookup actions run on daemon when it is '
+                        'running, $RANCHER_DAEMON_SOCKET environment variable can be used')
+    parser.add_argument('--noDaemon', action='store_true',
+                        help='run action in this process even if daemon is running. Implied by '
+                        '--profile, --connectionStats, --cacheStats and --trace* options')
+
     parser.add_argument('--dockerCompose',
                         help='docker compose path')
     parser.add_argument('--rancherCompose',
                         help='Rancher compose path (optional)', default=None)
+    parser.add_argument('--force', action='store_true',
+                        help='upgrade existing stack even if its compose is not changed')
     parser.add_argument('--stackEnvironment', default='{}',
                         help='Stack environment variables json')
+    parser.add_argument('--manifest', default=None,
+                        help='Stacks manifest path for deploy action')
+    parser.add_argument('--workers', default=4, type=int,
+                        help='Concurrent stack deployments for deploy action and service '
+                        'upgrades for upgrade-services. Default 4')
+    parser.add_argument('--selector', default=None,
+                        help='upgrade-services services: comma separated stack=<name> and '
+                        'launch config label=value pairs')
+    parser.add_argument('--batchSize', default=None, type=int,
+                        help='Instances upgraded at once by upgrade-service(s). Default 1')
+    parser.add_argument('--intervalMillis', default=None, type=int,
+                        help='Pause between upgrade batches in milliseconds. Default 2000')
+    parser.add_argument('--startFirst', action='store_true', default=None,
+                        help='Start new instances before stopping old ones on upgrade')
+    parser.add_argument('--batchFile', default='-',
+                        help='Actions file for batch action, JSON/YAML object per line. '
+                        'Default is stdin')
     parser.add_argument('--stackSvc', default=None,
                         help='Stack/Service string')
     # Action params
     required_named = parser.add_argument_group('required arguments')
     required_named.add_argument('--action',
-                                help='add-link,  remove-lnk, create-stack, remove-stack, get-port, get-service-port, upgrade-service, get-container-id, get-host-ip')
+                                help='add-link,  remove-lnk, create-stack, remove-stack, get-port, get-service-port, upgrade-service, upgrade-services, get-container-id, get-host-ip, deploy, update-links, get-host-port, inventory, get-instances, batch, daemon')
     parser.add_argument('--serviceId',
                         help="""target service id. Optional, parsed from hostname if not
                         set by pattern: serviceName.stackName.somedomain.TLD""")
-    parser.add_argument('--host', help='target hostname')
+    parser.add_argument('--host', help='target hostname. Comma separated for get-instances '
+                        'and upgrade-services')
     parser.add_argument(
-        '--hostId', help='Host id where to find available port')
+        '--hostId', help='Host id where to find available port. Comma separated for '
+        'get-host-port and inventory, all hosts when not set')
+    parser.add_argument('--count', default=1, type=int,
+                        help='Count of ports to allocate for get-port/get-host-port. Default 1')
     parser.add_argument('--portRangeStart', help='Start of desired port range')
     parser.add_argument('--portRangeEnd', help='End of desired port range')
     parser.add_argument(
@@ -60,11 +219,10 @@ def main():
                         help='internal service port. Optional, not needed for remove action')
     parser.add_argument('--data', default=None, type=str,
                         help='Data payload. Optional')
+    parser.add_argument('--mergeKeys', default=None,
+                        help='update-lb list identity fields json by dotted path. Default is '
+                        '{"lbConfig.portRules": ["protocol", "hostname", "sourcePort", "path"]}')
     args = parser.parse_args()
-    var_args = vars(args)
-
-    internal_port = var_args.pop('internalPort')
-    service_id = var_args.pop('serviceId')
 
     if args.action is None:
         parser.parse_args(['-h'])
@@ -78,54 +236,71 @@ def main():
     config.STACK_UPGRADE_TIMEOUT = args.stackUpgradeTimeout
     config.STACK_ACTIVE_TIMEOUT = args.stackActiveTimeout
     config.STACK_HEALTHY_TIMEOUT = args.stackHealthyTimeout
+    config.HTTP_POOL_SIZE = args.httpPoolSize
+    config.HTTP_CONNECT_TIMEOUT = args.connectTimeout
+    config.HTTP_READ_TIMEOUT = args.readTimeout
+    config.HTTP_CACHE_DIR = args.httpCacheDir
+    config.HTTP_CACHE_SIZE = args.httpCacheSize
+    config.HTTP_RATE_LIMIT = args.rateLimit
+    config.HTTP_RATE_BURST = args.rateBurst
+    config.HTTP_RETRIES = args.retries
+    config.HTTP_RETRY_BACKOFF = args.retryBackoff
+    config.HTTP_RETRY_MAX_BACKOFF = args.retryMaxBackoff
+    config.CIRCUIT_FAILURES = args.circuitFailures
+    config.CIRCUIT_RESET = args.circuitReset
+    config.PAGE_SIZE = args.pageSize
+    config.CONCURRENCY = args.concurrency
+    config.UNHEALTHY_GRACE = args.unhealthyGrace
+    config.RESTART_LIMIT = args.restartLimit
+    config.WAIT_EVENTS = args.waitEvents
+    config.EVENTS_URL = args.eventsUrl
+
+    config.NAME_CACHE_FILE = args.nameCacheFile
+    config.NAME_CACHE_TTL = args.nameCacheTtl
+    config.DAEMON_SOCKET = args.daemonSocket
+    config.TRACE_FILE = args.traceFile
+    config.TRACE_SUMMARY = args.traceSummary
+    config.TRACE_PROMETHEUS_FILE = args.tracePrometheus
 
-    if service_id is None and args.host is not None:
-        service_id = service.parse_service_id(args.host, True)
+    if args.connectionStats:
+        atexit.register(__print_connection_stats)
+    if args.cacheStats:
+        atexit.register(__print_cache_stats)
+    if args.traceFile or args.traceSummary or args.tracePrometheus:
+        from rancher import trace
+        atexit.register(trace.report)
 
-    if args.action.lower() not in ['add-link', 'remove-link', 'create-stack',
-                                   'remove-stack', 'get-port',
-                                   'get-service-port', 'update-lb',
-                                   'get-svc-id', 'get-container-id', 'get-host-ip']:
+    if args.action.lower() not in actions.ACTIONS + ['batch', 'daemon']:
         parser.parse_args(['-h'])
         exit(2)
 
-    # actions
-    if args.action.lower() == 'get-port':
-        print servicelink.get_available_port(args.loadBalancerId,
-                                             int(args.portRangeStart),
-                                             int(args.portRangeEnd), service_id)
-
-    elif args.action.lower() == 'get-service-port':
-        print servicelink.get_service_port(service_id)
-
-    elif args.action.lower() == 'add-link':
-        servicelink.add_load_balancer_target(service_id, args.host, args.externalPort,
-                                             internal_port)
-    elif args.action.lower() == 'remove-link':
-        servicelink.remove_load_balancer_target(
-            service_id, args.host, args.externalPort)
-
-    elif args.action.lower() == 'create-stack':
-        stack.create(args.stackName, args.dockerCompose,
-                     args.rancherCompose, args.stackTags)
-
-    elif args.action.lower() == 'remove-stack':
-        stack.remove('name', args.stackName)
-
-    elif args.action.lower() == 'update-lb':
-        service.update_load_balancer_service(
-            args.loadBalancerId, json.loads(args.data))
+    if args.action.lower() == 'batch':
+        from rancher import batch
+        defaults = vars(args)
+        del defaults['action']
+        batch_file = defaults.pop('batchFile')
+        if batch_file == '-':
+            failed = batch.run(sys.stdin, defaults)
+        else:
+            with open(batch_file) as stream:
+                failed = batch.run(stream, defaults)
+        exit(2 if failed else 0)
 
-    elif args.action.lower() == 'get-svc-id':
-        print service.parse_service_id(args.host)
+    if args.action.lower() == 'daemon':
+        from rancher import daemon
+        daemon.serve(config.DAEMON_SOCKET)
+        exit(0)
 
-    elif args.action.lower() == 'get-container-id':
-        instances = service.get_service_instances(service_id)
-        print instances[0]['externalId']
+    # Profile, stats and trace describe this process, so the action runs here
+    measured = args.profile or args.connectionStats or args.cacheStats or args.traceFile \
+        or args.traceSummary or args.tracePrometheus
+    if not args.noDaemon and not measured:
+        __run_on_daemon(args)
 
-    elif args.action.lower() == 'get-host-ip':
-        instances = service.get_service_instances(service_id)
-        host_id = instances[0]['hostId']
-        print host.get_host_ip(host_id)
+    if args.profile:
+        from rancher import profiler
+        profiler.run(lambda: __run_action(args), args.profileFile, args.profiler)
+    else:
+        __run_action(args)
 
 main()
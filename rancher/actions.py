@@ -0,0 +1,231 @@
+"""CLI actions. Params are rancher-cli.py arguments by their names.
+Handlers import what they need on first call, so an action loads only its own modules"""
+
+import json
+import sys
+from . import config, shutdown, memo
+
+
+def __json_param(value):
+    return json.loads(value) if isinstance(value, basestring) else value
+
+
+def __service_id(params):
+    """serviceId param or service id parsed from host"""
+
+    if params.get('serviceId') is None and params.get('host') is not None:
+        from . import service
+        return service.parse_service_id(params['host'], True)
+    return params.get('serviceId')
+
+
+def __host_ids(params):
+    return params['hostId'].split(',') if params.get('hostId') else None
+
+
+def __service_ids(params):
+    """Comma separated serviceId or host params as service ids"""
+
+    if params.get('serviceId'):
+        return params['serviceId'].split(',')
+    if params.get('host'):
+        from . import service
+        return [service.parse_service_id(host_name) for host_name in params['host'].split(',')]
+    shutdown.err('serviceId or host is required')
+
+
+def __strategy(params):
+    """In-service upgrade strategy fields set by params"""
+    return dict((name, params[name]) for name in ('batchSize', 'intervalMillis', 'startFirst')
+                if params.get(name) is not None)
+
+
+def __upgrade_service(params):
+    from . import service
+    service_id = __service_id(params)
+    if service_id is None:
+        shutdown.err('serviceId or host is required')
+    data = __strategy(params)
+    data.update(__json_param(params['data']) if params.get('data') else {})
+    return json.dumps({'serviceId': service_id,
+                       'seconds': service.upgrade_service(service_id, data)})
+
+
+def __upgrade_services(params):
+    from . import service
+    per_target = __json_param(params['data']) if params.get('data') else {}
+    targets = []
+    if params.get('serviceId') or params.get('host'):
+        targets.extend((params.get('serviceId') or params['host']).split(','))
+    targets.extend(per_target.keys())
+
+    data = {}
+    for target in targets:
+        service_id = service.parse_service_id(target) if '.' in target else target
+        data[service_id] = dict(__strategy(params), **per_target.get(target, {}))
+    if params.get('selector'):
+        for service_id in service.select_services(params['selector']):
+            data.setdefault(service_id, __strategy(params))
+    if not data:
+        shutdown.err('No services to upgrade')
+
+    results = service.upgrade_services(data, params.get('workers') or 4)
+    report = [results[service_id] for service_id in sorted(results)]
+    if [result for result in report if result['status'] != 'ok']:
+        print json.dumps(report)
+        shutdown.err('Some services are not upgraded')
+    return json.dumps(report)
+
+
+def __get_port(params):
+    from . import servicelink
+    count = int(params.get('count') or 1)
+    available = servicelink.get_available_ports(params['loadBalancerId'],
+                                                int(params['portRangeStart']),
+                                                int(params['portRangeEnd']), count,
+                                                __service_id(params))
+    return '\n'.join(str(port) for port in available)
+
+
+def __get_host_port(params):
+    from . import host
+    assignments = host.get_available_ports(params.get('stackSvc'), __host_ids(params),
+                                           int(params['portRangeStart']),
+                                           int(params['portRangeEnd']),
+                                           int(params.get('count') or 1))
+    return json.dumps([{'hostId': host_id, 'port': port} for host_id, port in assignments])
+
+
+def __inventory(params):
+    from . import inventory
+    return json.dumps(inventory.load(__host_ids(params)))
+
+
+def __get_service_port(params):
+    from . import servicelink
+    return servicelink.get_service_port(__service_id(params))
+
+
+def __add_link(params):
+    from . import servicelink
+    servicelink.add_load_balancer_target(__service_id(params), params['host'],
+                                         params['externalPort'],
+                                         params.get('internalPort'))
+
+
+def __remove_link(params):
+    from . import servicelink
+    servicelink.remove_load_balancer_target(
+        __service_id(params), params['host'], params['externalPort'])
+
+
+def __update_links(params):
+    return json.dumps(update_links(__json_param(params['data'])))
+
+
+def __create_stack(params):
+    from . import stack
+    stack.create(params['stackName'], params['dockerCompose'],
+                 params.get('rancherCompose'), params.get('stackTags'),
+                 bool(params.get('force')))
+
+
+def __deploy(params):
+    from . import deploy
+    results = deploy.deploy(params['manifest'], params.get('workers', 4))
+    if [result for result in results.values() if result['status'] != 'ok']:
+        shutdown.err('Some stacks are not deployed')
+
+
+def __remove_stack(params):
+    from . import stack
+    stack.remove('name', params['stackName'])
+
+
+def __update_lb(params):
+    from . import service
+    keys = params.get('mergeKeys')
+    return json.dumps(service.update_load_balancer_service(
+        params['loadBalancerId'], __json_param(params['data']),
+        __json_param(keys) if keys else None))
+
+
+def __get_svc_id(params):
+    from . import service
+    return service.parse_service_id(params['host'])
+
+
+def __get_container_id(params):
+    from . import service
+    instances = service.get_service_instances(__service_id(params))
+    return instances[0]['externalId']
+
+
+def __get_instances(params):
+    from . import container
+    for instance in container.iter_service_instances(__service_ids(params)):
+        sys.stdout.write(json.dumps(instance) + '\n')
+        sys.stdout.flush()
+
+
+def __get_host_ip(params):
+    from . import service, host
+    instances = service.get_service_instances(__service_id(params))
+    host_id = instances[0]['hostId']
+    return host.get_host_ip(host_id)
+
+
+HANDLERS = {
+    'add-link': __add_link,
+    'remove-link': __remove_link,
+    'create-stack': __create_stack,
+    'remove-stack': __remove_stack,
+    'get-port': __get_port,
+    'get-service-port': __get_service_port,
+    'update-lb': __update_lb,
+    'get-svc-id': __get_svc_id,
+    'get-container-id': __get_container_id,
+    'get-host-ip': __get_host_ip,
+    'deploy': __deploy,
+    'update-links': __update_links,
+    'get-host-port': __get_host_port,
+    'inventory': __inventory,
+    'get-instances': __get_instances,
+    'upgrade-service': __upgrade_service,
+    'upgrade-services': __upgrade_services,
+}
+
+ACTIONS = ['add-link', 'remove-link', 'create-stack', 'remove-stack', 'get-port',
+           'get-service-port', 'update-lb', 'get-svc-id', 'get-container-id',
+           'get-host-ip', 'deploy', 'update-links', 'get-host-port',
+           'inventory', 'get-instances', 'upgrade-service', 'upgrade-services']
+
+
+def run(params):
+    """Run action. Returns action output or None"""
+
+    action = params['action'].lower()
+    if params.get('loadBalancerId') is not None:
+        config.LOAD_BALANCER_SVC_ID = params['loadBalancerId']
+
+    if action not in HANDLERS:
+        shutdown.err('Unknown action ' + action)
+    # Repeated GETs of one action are sent once
+    with memo.scope():
+        return HANDLERS[action](params)
+
+
+def update_links(data):
+    """Apply {"add": [links], "remove": [links]} load balancer changes in one write.
+    Link service is resolved from host when serviceId is not set"""
+
+    from . import servicelink, service
+    links = {}
+    for kind in ('add', 'remove'):
+        links[kind] = []
+        for link in data.get(kind) or []:
+            link = dict(link)
+            if link.get('serviceId') is None:
+                link['serviceId'] = service.parse_service_id(link['host'], True)
+            links[kind].append(link)
+    return servicelink.update_load_balancer_targets(links['add'], links['remove'])
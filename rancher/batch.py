@@ -0,0 +1,77 @@
+"""Run many CLI actions in one process.
+
+Input has one action per line as JSON or YAML flow mapping, keys are
+rancher-cli.py argument names:
+
+{"action": "get-svc-id", "host": "api.stack-name"}
+{action: get-service-port, host: api.stack-name}
+
+Each action result is written as soon as it finishes as a JSON line with
+line number, action, exit code, result or error and the action output."""
+
+import json
+import sys
+from StringIO import StringIO
+import yaml
+from . import actions, shutdown
+
+
+def parse_line(line):
+    """Parse action line"""
+    try:
+        return json.loads(line)
+    except ValueError:
+        return yaml.safe_load(line)
+
+
+def run_one(params):
+    """Run action capturing its output. Returns result record"""
+
+    record = {'action': params.get('action'), 'code': 0, 'result': None, 'error': None}
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        record['result'] = actions.run(params)
+    except shutdown.Shutdown as ex:
+        record['code'] = ex.code
+        if ex.code:
+            record['error'] = ex.text
+        else:
+            record['result'] = ex.text
+    except SystemExit as ex:
+        record['code'] = ex.code
+    except Exception as ex:  # pylint: disable=broad-except
+        record['code'] = 1
+        record['error'] = repr(ex)
+    finally:
+        record['output'] = sys.stdout.getvalue()
+        sys.stdout = stdout
+    return record
+
+
+def run(stream, defaults, out=None):
+    """Run actions from stream lines over defaults params.
+    Returns count of failed actions"""
+
+    out = out or sys.stdout
+    failed = 0
+    for number, line in enumerate(stream, 1):
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        try:
+            params = parse_line(line)
+        except yaml.YAMLError as ex:
+            params = ex
+        if not isinstance(params, dict) or 'action' not in params:
+            record = {'action': None, 'code': 2, 'result': None, 'output': '',
+                      'error': 'Could not parse action line: ' + line.strip()}
+        else:
+            merged = dict(defaults)
+            merged.update(params)
+            record = run_one(merged)
+        record['line'] = number
+        if record['code']:
+            failed += 1
+        out.write(json.dumps(record) + '\n')
+        out.flush()
+    return failed
@@ -0,0 +1,40 @@
+"""Paginated Rancher API collections"""
+
+import json
+from . import http_util, shutdown, config
+
+
+def __with_limit(end_point):
+    separator = '&' if '?' in end_point else '?'
+    return '{}{}limit={}'.format(end_point, separator, int(config.PAGE_SIZE))
+
+
+def get_page(end_point):
+    """Get first collection page response, limited by config.PAGE_SIZE"""
+    return http_util.get(__with_limit(end_point))
+
+
+def iterate(end_point, response=None):
+    """Iterate collection items lazily following pagination links.
+    Response is an already fetched first page (optional)"""
+
+    if response is None:
+        response = get_page(end_point)
+    while True:
+        if response.status_code not in range(200, 300):
+            shutdown.err(response.text)
+
+        page = json.loads(response.content)
+        response = None
+        for item in page['data']:
+            yield item
+
+        pagination = page.get('pagination') or {}
+        if not pagination.get('next'):
+            return
+        response = http_util.get(pagination['next'])
+
+
+def get_all(end_point):
+    """Get all collection items as list"""
+    return list(iterate(end_point))
@@ -8,3 +8,30 @@ LOAD_BALANCER_SVC_ID = ""
 STACK_UPGRADE_TIMEOUT = ""
 STACK_ACTIVE_TIMEOUT = ""
 STACK_HEALTHY_TIMEOUT = ""
+HTTP_POOL_SIZE = 10
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 60
+NAME_CACHE_FILE = ""
+NAME_CACHE_TTL = 0
+API_FILTERS = True
+PAGE_SIZE = 100
+WAIT_EVENTS = False
+EVENTS_URL = ""
+EVENTS_POLL_INTERVAL = 30
+UNHEALTHY_GRACE = 60
+RESTART_LIMIT = 3
+LINK_UPDATE_ATTEMPTS = 3
+CONCURRENCY = 8
+DAEMON_SOCKET = ""
+TRACE_FILE = ""
+TRACE_SUMMARY = False
+TRACE_PROMETHEUS_FILE = ""
+HTTP_CACHE_DIR = ""
+HTTP_CACHE_SIZE = 50
+HTTP_RATE_LIMIT = 0
+HTTP_RATE_BURST = 10
+HTTP_RETRIES = 3
+HTTP_RETRY_BACKOFF = 0.5
+HTTP_RETRY_MAX_BACKOFF = 30
+CIRCUIT_FAILURES = 5
+CIRCUIT_RESET = 30
@@ -1,7 +1,7 @@
 """ Manages containers """
 
 import json
-from . import http_util, shutdown, api
+from . import http_util, shutdown, api, config, collection, pool, inventory
 
 
 def __get(instance_id):
@@ -21,3 +21,57 @@ def get_host_id(instance_id):
 def get_container_id(instance_id):
     """Get container id by instance id"""
     return __get(instance_id)['externalId']
+
+
+def diagnose_service_instances(service_id, start_counts):
+    """Describe not running or unhealthy service instances. Detects restart loops
+    by instance startCount growth since first call with the same start_counts"""
+
+    details = []
+    restarting = False
+    end_point = '{}/services/{}/instances'.format(api.V1, service_id)
+    for instance in collection.iterate(end_point):
+        start_count = instance.get('startCount') or 0
+        restarts = start_count - start_counts.setdefault(instance['id'], start_count)
+        if restarts >= int(config.RESTART_LIMIT):
+            restarting = True
+        if instance.get('state') != 'running' or restarts > 0 \
+                or instance.get('healthState') not in (None, 'healthy'):
+            details.append('  instance {} ({}) on host {}: state {}, health {}, '
+                           'restarts {}: {}'.format(
+                               instance.get('name'), instance['id'], instance.get('hostId'),
+                               instance.get('state'), instance.get('healthState'),
+                               restarts, instance.get('transitioningMessage') or ''))
+    return details, restarting
+
+
+def __expanded_host_ip(instance):
+    hosts = instance.get('hosts') or []
+    if not hosts:
+        return None
+    endpoints = hosts[0].get('publicEndpoints') or []
+    return endpoints[0]['ipAddress'] if endpoints else hosts[0].get('agentIpAddress')
+
+
+def iter_service_instances(service_ids):
+    """Yield every instance of services with container id and host ip joined in.
+    Services are fetched concurrently. Host comes from include=hosts expansion,
+    servers without it are served by one bulk hosts inventory"""
+
+    def fetch(service_id):
+        end_point = '{}/services/{}/instances?include=hosts'.format(api.V1, service_id)
+        return collection.get_all(end_point)
+
+    index = None
+    for service_id, instances in pool.imap_unordered(fetch, service_ids, config.CONCURRENCY):
+        for instance in instances:
+            host_ip = __expanded_host_ip(instance)
+            if host_ip is None and instance.get('hostId'):
+                if index is None:
+                    index = inventory.load()
+                host = index['hosts'].get(instance['hostId'])
+                host_ip = host['publicIp'] if host else None
+            yield {'serviceId': service_id, 'instanceId': instance['id'],
+                   'name': instance.get('name'), 'containerId': instance.get('externalId'),
+                   'hostId': instance.get('hostId'), 'hostIp': host_ip,
+                   'state': instance.get('state'), 'healthState': instance.get('healthState')}
@@ -0,0 +1,153 @@
+"""Long running action server on a local Unix socket.
+
+Keeps api session, stack/service id cache and interpreter warm between
+actions. Protocol is one JSON line each way per connection:
+
+request:  {"scope": "<api url>|<project>|<api key>", "config": {...}, "params": {...}}
+response: {"code": <exit code>, "result": <action result>, "output": <action stdout>,
+           "error": <unexpected exception>}
+
+Requests of another api scope are refused with code -1, client runs them directly.
+Requests are served one by one, config is set for the request and restored after.
+So only quick lookups are served, actions that write or wait for minutes and
+streaming actions are refused and run by the client"""
+
+import json
+import os
+import signal
+import socket
+import sys
+import SocketServer
+from StringIO import StringIO
+from . import config, actions, ports, shutdown
+
+# Config tuned by client per request. Connection settings are daemon's own
+REQUEST_CONFIG = ('LOAD_BALANCER_SVC_ID', 'STACK_UPGRADE_TIMEOUT', 'STACK_ACTIVE_TIMEOUT',
+                  'STACK_HEALTHY_TIMEOUT', 'PAGE_SIZE', 'CONCURRENCY', 'UNHEALTHY_GRACE',
+                  'RESTART_LIMIT', 'WAIT_EVENTS', 'EVENTS_URL', 'HTTP_RETRIES',
+                  'HTTP_RETRY_BACKOFF', 'HTTP_RETRY_MAX_BACKOFF')
+
+# Short read actions, others would hold the daemon from other clients
+ACTIONS = ('get-port', 'get-service-port', 'get-svc-id', 'get-container-id', 'get-host-ip',
+           'get-host-port', 'inventory')
+
+REFUSED = -1
+_CONNECT_TIMEOUT = 0.5
+
+
+def scope():
+    """Api scope requests of one daemon must share"""
+    return '{}|{}|{}'.format(config.RANCHER_BASE_URL, config.RANCHER_PROJECT_ID,
+                             config.RANCHER_API_ACCESS_KEY)
+
+
+def request_config():
+    """Current per request config values"""
+    return dict((name, getattr(config, name)) for name in REQUEST_CONFIG)
+
+
+def handle(request):
+    """Run request. Returns response record"""
+
+    if request.get('scope') != scope():
+        return {'code': REFUSED, 'result': None, 'output': '',
+                'error': 'Daemon serves another api scope'}
+    if str(request['params'].get('action')).lower() not in ACTIONS:
+        return {'code': REFUSED, 'result': None, 'output': '',
+                'error': 'Daemon does not serve this action'}
+    saved = request_config()
+    try:
+        for name, value in (request.get('config') or {}).items():
+            if name in REQUEST_CONFIG:
+                setattr(config, name, value)
+        # Port reservations last one action as in direct mode
+        ports.clear()
+        return __run(request['params'])
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+
+
+def __run(params):
+    response = {'code': 0, 'result': None, 'error': None}
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        response['result'] = actions.run(params)
+    except SystemExit as ex:
+        response['code'] = ex.code
+    except Exception as ex:  # pylint: disable=broad-except
+        response['code'] = 1
+        response['error'] = repr(ex)
+    finally:
+        response['output'] = sys.stdout.getvalue()
+        sys.stdout = stdout
+    return response
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line)
+            response = handle(request)
+        except (ValueError, KeyError, AttributeError) as ex:
+            response = {'code': 2, 'result': None, 'output': '',
+                        'error': 'Bad request: ' + repr(ex)}
+        self.wfile.write(json.dumps(response) + '\n')
+
+
+def serve(socket_path):
+    """Serve actions on socket_path until interrupted"""
+
+    directory = os.path.dirname(socket_path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, 0700)
+    if os.path.exists(socket_path):
+        if call(socket_path, None, {}) is not None:
+            shutdown.err('Daemon is already running on ' + socket_path)
+        os.remove(socket_path)
+
+    umask = os.umask(0077)
+    try:
+        server = SocketServer.UnixStreamServer(socket_path, _Handler)
+    finally:
+        os.umask(umask)
+    signal.signal(signal.SIGTERM, __stop)
+    print 'Serving on ' + socket_path
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+def __stop(*_):
+    raise KeyboardInterrupt()
+
+
+def call(socket_path, api_scope, params):
+    """Run action params on daemon.
+    Returns response record or None when daemon is not running"""
+
+    if not socket_path or not os.path.exists(socket_path):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.settimeout(_CONNECT_TIMEOUT)
+        client.connect(socket_path)
+        # Actions may wait for stacks for minutes
+        client.settimeout(None)
+        stream = client.makefile('rw')
+        stream.write(json.dumps({'scope': api_scope, 'config': request_config(),
+                                 'params': params}) + '\n')
+        stream.flush()
+        line = stream.readline()
+    except socket.error:
+        return None
+    finally:
+        client.close()
+    return json.loads(line) if line else None
@@ -0,0 +1,187 @@
+"""Deploy many stacks concurrently following their dependencies.
+
+Manifest is a YAML/JSON file:
+
+stacks:
+  - name: db
+    dockerCompose: db/docker-compose.yml
+    rancherCompose: db/rancher-compose.yml
+    tags: infra
+  - name: api
+    dockerCompose: api/docker-compose.yml
+    dependsOn: [db]
+
+Compose paths are relative to the manifest directory."""
+
+import os
+import threading
+import Queue
+from time import time
+import yaml
+from . import stack, shutdown
+
+_OK = 'ok'
+_FAILED = 'failed'
+_SKIPPED = 'skipped'
+
+
+def load_manifest(manifest_path):
+    """Load and validate stacks manifest. Returns stacks by name in manifest order"""
+
+    try:
+        with open(manifest_path) as file_object:
+            manifest = yaml.safe_load(file_object)
+    except (IOError, yaml.YAMLError) as ex:
+        shutdown.err('Could not read manifest {}: {}'.format(manifest_path, ex))
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    stacks = {}
+    order = []
+    for item in (manifest or {}).get('stacks') or []:
+        if 'name' not in item or 'dockerCompose' not in item:
+            shutdown.err('Manifest stack must have name and dockerCompose: ' + str(item))
+        rancher_compose = item.get('rancherCompose')
+        if rancher_compose:
+            rancher_compose = os.path.join(base_dir, rancher_compose)
+        stacks[item['name']] = {
+            'name': item['name'],
+            'dockerCompose': os.path.join(base_dir, item['dockerCompose']),
+            'rancherCompose': rancher_compose,
+            'tags': item.get('tags'),
+            'dependsOn': list(item.get('dependsOn') or [])}
+        order.append(item['name'])
+
+    for name in order:
+        for dependency in stacks[name]['dependsOn']:
+            if dependency not in stacks:
+                shutdown.err('Stack {} depends on unknown stack {}'.format(name, dependency))
+    __check_cycles(stacks)
+    return [stacks[name] for name in order]
+
+
+def __check_cycles(stacks):
+    visited = {}
+
+    def visit(name, path):
+        if visited.get(name) == 'done':
+            return
+        if visited.get(name) == 'visiting':
+            shutdown.err('Dependency cycle: ' + ' -> '.join(path + [name]))
+        visited[name] = 'visiting'
+        for dependency in stacks[name]['dependsOn']:
+            visit(dependency, path + [name])
+        visited[name] = 'done'
+
+    for name in stacks:
+        visit(name, [])
+
+
+def __worker(tasks, done):
+    while True:
+        item = tasks.get()
+        if item is None:
+            return
+        result = {'name': item['name'], 'start': time(), 'status': _OK, 'error': None}
+        try:
+            stack.create(item['name'], item['dockerCompose'], item['rancherCompose'],
+                         item['tags'])
+        except shutdown.Shutdown as ex:
+            if ex.code:
+                result['status'] = _FAILED
+                result['error'] = ex.text
+        except Exception as ex:  # pylint: disable=broad-except
+            result['status'] = _FAILED
+            result['error'] = repr(ex)
+        result['end'] = time()
+        done.put(result)
+
+
+def deploy(manifest_path, workers=4):
+    """Create or upgrade manifest stacks with bounded concurrency.
+    Stack starts when all its dependencies are deployed, dependents of a failed
+    stack are skipped. Returns per stack results"""
+
+    stacks = load_manifest(manifest_path)
+    by_name = dict((item['name'], item) for item in stacks)
+    waiting = dict((item['name'], set(item['dependsOn'])) for item in stacks)
+    results = {}
+    tasks = Queue.Queue()
+    done = Queue.Queue()
+    threads = [threading.Thread(target=__worker, args=(tasks, done))
+               for _ in range(max(1, min(int(workers), len(stacks))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    started = time()
+    running = 0
+    while waiting or running:
+        for name in [name for name in waiting if not waiting[name]]:
+            del waiting[name]
+            tasks.put(by_name[name])
+            running += 1
+        if not running:
+            break
+        result = done.get()
+        running -= 1
+        results[result['name']] = result
+        __release_dependents(result, waiting, results)
+
+    for _ in threads:
+        tasks.put(None)
+    # Stacks left waiting depend on a skipped stack
+    for name in waiting:
+        results[name] = {'name': name, 'status': _SKIPPED, 'start': None, 'end': None,
+                         'error': 'dependency failed'}
+
+    __report([results[item['name']] for item in stacks], by_name, started)
+    return results
+
+
+def __release_dependents(result, waiting, results):
+    failed = [result['name']] if result['status'] != _OK else []
+    while failed:
+        name = failed.pop()
+        for dependent in [dependent for dependent in waiting if name in waiting[dependent]]:
+            del waiting[dependent]
+            results[dependent] = {'name': dependent, 'status': _SKIPPED, 'start': None,
+                                  'end': None, 'error': 'dependency {} failed'.format(name)}
+            failed.append(dependent)
+    if result['status'] == _OK:
+        for dependencies in waiting.values():
+            dependencies.discard(result['name'])
+
+
+def __critical_path(results, by_name):
+    """Longest chain of deployed stack durations along dependencies"""
+
+    finish = {}
+
+    def chain(name):
+        if name not in finish:
+            result = results[name]
+            duration = result['end'] - result['start'] if result['start'] else 0
+            previous = [chain(dependency) for dependency in by_name[name]['dependsOn']]
+            best = max(previous) if previous else (0, [])
+            finish[name] = (best[0] + duration, best[1] + [name])
+        return finish[name]
+
+    return max(chain(name) for name in results) if results else (0, [])
+
+
+def __report(results, by_name, started):
+    print '{:<30} {:<8} {:>10} {:>10} {:>10}'.format(
+        'STACK', 'STATUS', 'START', 'END', 'DURATION')
+    for result in results:
+        if result['start'] is None:
+            print '{:<30} {:<8} {:>10} {:>10} {:>10}'.format(
+                result['name'], result['status'], '-', '-', '-')
+        else:
+            print '{:<30} {:<8} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+                result['name'], result['status'], result['start'] - started,
+                result['end'] - started, result['end'] - result['start'])
+        if result['error']:
+            print '    ' + result['error']
+    length, path = __critical_path(dict((item['name'], item) for item in results), by_name)
+    print 'Total: {:.1f}s, critical path: {:.1f}s ({})'.format(
+        time() - started, length, ' -> '.join(path))
@@ -0,0 +1,36 @@
+"""Structural diff of API resources"""
+
+import json
+
+
+def __key(value):
+    return json.dumps(value, sort_keys=True)
+
+
+def diff(old, new, path=None):
+    """Diff two JSON-like values. Lists are compared as unordered sets of items.
+    Returns list of {'op': 'add'|'remove'|'change', 'path': 'a.b', 'value'/'old'/'new'}"""
+
+    path = path or []
+    changes = []
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in sorted(set(old.keys()) | set(new.keys())):
+            key_path = path + [str(key)]
+            if key not in new:
+                changes.append({'op': 'remove', 'path': '.'.join(key_path), 'value': old[key]})
+            elif key not in old:
+                changes.append({'op': 'add', 'path': '.'.join(key_path), 'value': new[key]})
+            else:
+                changes.extend(diff(old[key], new[key], key_path))
+    elif isinstance(old, list) and isinstance(new, list):
+        old_keys = set(__key(item) for item in old)
+        new_keys = set(__key(item) for item in new)
+        for item in old:
+            if __key(item) not in new_keys:
+                changes.append({'op': 'remove', 'path': '.'.join(path), 'value': item})
+        for item in new:
+            if __key(item) not in old_keys:
+                changes.append({'op': 'add', 'path': '.'.join(path), 'value': item})
+    elif old != new:
+        changes.append({'op': 'change', 'path': '.'.join(path), 'old': old, 'new': new})
+    return changes
@@ -0,0 +1,86 @@
+"""Rancher resource.change event subscription. Needs websocket-client package"""
+
+import base64
+import json
+import socket
+from time import time
+from . import api, config
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+_EVENT = 'resource.change'
+
+
+class EventsError(Exception):
+    """Event stream is closed or broken"""
+    pass
+
+
+def available():
+    """Event driven waits are enabled and supported"""
+    return bool(config.WAIT_EVENTS) and websocket is not None
+
+
+def subscribe_url():
+    """Project event stream url"""
+
+    if config.EVENTS_URL:
+        return config.EVENTS_URL
+    base_url = config.RANCHER_BASE_URL.replace('https://', 'wss://', 1) \
+        .replace('http://', 'ws://', 1)
+    return '{}/{}/projects/{}/subscribe?eventNames={}'.format(
+        base_url, api.V1, config.RANCHER_PROJECT_ID, _EVENT)
+
+
+class Subscription(object):
+    """Subscription to resource.change events of given resource ids"""
+
+    def __init__(self, resource_ids):
+        self.resource_ids = set(resource_ids)
+        token = base64.b64encode('{}:{}'.format(
+            config.RANCHER_API_ACCESS_KEY, config.RANCHER_API_SECRET_KEY))
+        try:
+            self.socket = websocket.create_connection(
+                subscribe_url(), header=['Authorization: Basic ' + token],
+                timeout=float(config.HTTP_CONNECT_TIMEOUT), sslopt={'cert_reqs': 0})
+        except (websocket.WebSocketException, socket.error) as ex:
+            raise EventsError(str(ex))
+
+    def next_resource(self, timeout):
+        """Wait for next change of subscribed resources. None on timeout"""
+
+        # Events of other resources keep coming, so time out on the whole wait
+        deadline = time() + timeout
+        while True:
+            remaining = deadline - time()
+            if remaining <= 0:
+                return None
+            self.socket.settimeout(remaining)
+            try:
+                message = self.socket.recv()
+            except websocket.WebSocketTimeoutException:
+                return None
+            except (websocket.WebSocketException, socket.error) as ex:
+                raise EventsError(str(ex))
+            if not message:
+                raise EventsError('Event stream closed')
+
+            try:
+                event = json.loads(message)
+            except ValueError:
+                continue
+            if event.get('name') != _EVENT or event.get('resourceId') not in self.resource_ids:
+                continue
+            resource = (event.get('data') or {}).get('resource')
+            if resource is not None:
+                return resource
+
+    def close(self):
+        """Close event stream"""
+        try:
+            self.socket.close()
+        except (websocket.WebSocketException, socket.error):
+            pass
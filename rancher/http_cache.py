@@ -0,0 +1,123 @@
+"""Persistent conditional GET cache.
+
+Responses with ETag or Last-Modified are kept in config.HTTP_CACHE_DIR, one
+file per url and api key: a JSON line with status, headers and validators
+followed by the body. Requests for kept urls send If-None-Match and
+If-Modified-Since, 304 answers are served from the file.
+
+Files are replaced atomically, so parallel processes read either the old or
+the new entry. Least recently used entries are evicted above
+config.HTTP_CACHE_SIZE megabytes under an exclusive lock of the directory"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from . import config
+
+_LOCK_FILE = '.lock'
+_SUFFIX = '.entry'
+_KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+_STATS = {'revalidated': 0, 'stored': 0, 'evicted': 0}
+
+
+def enabled():
+    """Cache directory is configured"""
+    return bool(config.HTTP_CACHE_DIR)
+
+
+def __path(url):
+    key = hashlib.sha256('{}|{}'.format(config.RANCHER_API_ACCESS_KEY, url)).hexdigest()
+    return os.path.join(config.HTTP_CACHE_DIR, key + _SUFFIX)
+
+
+def load(url):
+    """Get kept entry of url: {'status', 'headers', 'body'} or None"""
+
+    try:
+        with open(__path(url), 'rb') as input_file:
+            meta = json.loads(input_file.readline())
+            body = input_file.read()
+    except (IOError, OSError, ValueError):
+        return None
+    if meta.get('url') != url:
+        return None
+    meta['body'] = body
+    return meta
+
+
+def validators(entry):
+    """Conditional request headers of entry"""
+
+    headers = {}
+    if entry['headers'].get('ETag'):
+        headers['If-None-Match'] = entry['headers']['ETag']
+    if entry['headers'].get('Last-Modified'):
+        headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+    return headers
+
+
+def touch(url):
+    """Mark entry as recently used after serving it"""
+
+    _STATS['revalidated'] += 1
+    try:
+        os.utime(__path(url), None)
+    except OSError:
+        pass  # evicted meanwhile
+
+
+def store(url, status, headers, body):
+    """Keep response if it has validators"""
+
+    kept = dict((name, headers[name]) for name in _KEPT_HEADERS if headers.get(name))
+    if not kept.get('ETag') and not kept.get('Last-Modified'):
+        return
+    path = __path(url)
+    tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.current_thread().ident)
+    try:
+        if not os.path.isdir(config.HTTP_CACHE_DIR):
+            os.makedirs(config.HTTP_CACHE_DIR, 0700)
+        with open(tmp_path, 'wb') as output:
+            output.write(json.dumps({'url': url, 'status': status, 'headers': kept}) + '\n')
+            output.write(body)
+        os.rename(tmp_path, path)
+        _STATS['stored'] += 1
+        __evict()
+    except (IOError, OSError):
+        pass  # cache is best effort
+
+
+def __evict():
+    limit = float(config.HTTP_CACHE_SIZE) * 1024 * 1024
+    with open(os.path.join(config.HTTP_CACHE_DIR, _LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            entries = []
+            for name in os.listdir(config.HTTP_CACHE_DIR):
+                if not name.endswith(_SUFFIX):
+                    continue
+                path = os.path.join(config.HTTP_CACHE_DIR, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= limit:
+                    break
+                try:
+                    os.remove(path)
+                    _STATS['evicted'] += 1
+                except OSError:
+                    pass
+                total -= size
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def stats():
+    """Get revalidated, stored and evicted entries counters"""
+    return dict(_STATS)
@@ -1,26 +1,219 @@
 """Simple HTTP util for Rancher API"""
 
+import socket
+import threading
+from time import time
 import requests
-from . import config
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+# Optional layers (trace, disk cache, retries) are imported where used, so
+# actions do not load them all up front
+from . import config, memo
 
 _GET = 'get'
 _POST = 'post'
 _PUT = 'put'
 
-_HTTP = {
-    _GET: requests.get,
-    _POST: requests.post,
-    _PUT: requests.put
-}
-
 _HEADERS = {'Content-Type': 'application/json', 'Accept': 'application/json'}
 
+_SESSION = None
+
+# Connection timings of current thread request
+_TIMINGS = threading.local()
+
+
+class _TimedConnection(object):
+    """Records dns and connect (tcp and tls) seconds of new connections"""
+
+    def _new_conn(self):
+        dns_host = self._dns_host
+        started = time()
+        try:
+            # Resolved here to time dns apart from connect
+            address = socket.getaddrinfo(dns_host, self.port, 0, socket.SOCK_STREAM)[0][4]
+            self._dns_host = address[0]
+        except socket.gaierror:
+            pass  # connect reports it
+        _TIMINGS.dns = time() - started
+        try:
+            return super(_TimedConnection, self)._new_conn()
+        finally:
+            self._dns_host = dns_host
+
+    def connect(self):
+        started = time()
+        super(_TimedConnection, self).connect()
+        _TIMINGS.connect = time() - started - getattr(_TIMINGS, 'dns', 0.0)
+
+
+class _TimedHTTPConnection(_TimedConnection, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnection, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedAdapter(HTTPAdapter):
+    """Adapter with connection timings for trace"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _TimedHTTPConnectionPool,
+                                                   'https': _TimedHTTPSConnectionPool}
+
+
+def session():
+    """Get shared keep-alive session. Created on first use from config"""
+
+    global _SESSION  # pylint: disable=global-statement
+    if _SESSION is None:
+        from . import trace
+        pool_size = int(config.HTTP_POOL_SIZE)
+        adapter_class = _TimedAdapter if trace.enabled() else HTTPAdapter
+        adapter = adapter_class(pool_connections=pool_size, pool_maxsize=pool_size)
+        _SESSION = requests.Session()
+        _SESSION.mount('http://', adapter)
+        _SESSION.mount('https://', adapter)
+        _SESSION.headers.update(_HEADERS)
+        _SESSION.auth = (config.RANCHER_API_ACCESS_KEY, config.RANCHER_API_SECRET_KEY)
+        _SESSION.verify = False
+    return _SESSION
+
+
+def close():
+    """Close shared session and its connection pools"""
+
+    global _SESSION  # pylint: disable=global-statement
+    if _SESSION is not None:
+        _SESSION.close()
+        _SESSION = None
+
+
+def connection_stats():
+    """Get count of opened and reused connections of shared session"""
+
+    opened = 0
+    requests_sent = 0
+    if _SESSION is not None:
+        for adapter in set(_SESSION.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                opened += pool.num_connections
+                requests_sent += pool.num_requests
+    return {'opened': opened, 'reused': max(requests_sent - opened, 0),
+            'requests': requests_sent}
+
 
 def _send_request(method, url, json_data=None):
-    """Send HTTP request"""
-    return _HTTP[method]('{}/{}'.format(config.RANCHER_BASE_URL, url),
-                         auth=(config.RANCHER_API_ACCESS_KEY, config.RANCHER_API_SECRET_KEY),
-                         headers=_HEADERS, json=json_data, verify=False)
+    """Send HTTP request. GETs are served from memo when it is on,
+    and revalidated against disk cache when it is configured"""
+    if not url.startswith(('http://', 'https://')):
+        url = '{}/{}'.format(config.RANCHER_BASE_URL, url)
+    if method == _GET:
+        response = memo.get(url)
+        if response is not None:
+            return response
+
+    cached = headers = None
+    if method == _GET and config.HTTP_CACHE_DIR:
+        from . import http_cache
+        cached = http_cache.load(url)
+        headers = http_cache.validators(cached) if cached is not None else None
+    response = __resilient_request(method, url, json_data, headers)
+
+    if response.status_code == 404:
+        # Cached stack/service id could be of a removed resource
+        from . import name_cache
+        name_cache.invalidate_url(url)
+    if method == _GET:
+        if config.HTTP_CACHE_DIR:
+            response = __conditional_response(url, response, cached)
+        memo.put(url, response)
+    else:
+        memo.invalidate(url)
+    return response
+
+
+def __resilient_request(method, url, json_data, headers):
+    """Send request within rate limit and circuit breaker, retry failed attempts"""
+
+    from . import resilience, trace
+    attempt = 0
+    while True:
+        response = error = None
+        try:
+            resilience.allow()
+            resilience.acquire()
+            if not trace.enabled():
+                response = session().request(method, url, json=json_data, headers=headers,
+                                             timeout=(float(config.HTTP_CONNECT_TIMEOUT),
+                                                      float(config.HTTP_READ_TIMEOUT)))
+            else:
+                response = __traced_request(method, url, json_data, headers)
+        except (resilience.CircuitOpen, requests.exceptions.RequestException) as ex:
+            error = ex
+        if not isinstance(error, resilience.CircuitOpen):
+            resilience.record(error is not None or resilience.unhealthy(response))
+        if error is None and not resilience.unhealthy(response):
+            return response
+        if attempt < int(config.HTTP_RETRIES) and resilience.retryable(method, response, error):
+            attempt += 1
+            resilience.backoff(attempt, response, error)
+            continue
+        resilience.give_up()
+        if error is not None:
+            from . import shutdown
+            shutdown.err('Rancher api {} {} failed: {}'.format(method.upper(), url, error))
+        return response
+
+
+def __conditional_response(url, response, cached):
+    """Serve 304 from cache entry, keep new responses"""
+
+    from . import http_cache
+    if response.status_code == 304 and cached is not None:
+        http_cache.touch(url)
+        # pylint: disable=protected-access
+        response._content = cached['body']
+        response.status_code = cached['status']
+        response.headers.update(cached['headers'])
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    elif response.status_code in range(200, 300):
+        http_cache.store(url, response.status_code, response.headers, response.content)
+    return response
+
+
+def __traced_request(method, url, json_data, headers=None):
+    from . import trace
+    _TIMINGS.dns = _TIMINGS.connect = 0.0
+    started = time()
+    response = None
+    try:
+        response = session().request(method, url, json=json_data, headers=headers,
+                                     timeout=(float(config.HTTP_CONNECT_TIMEOUT),
+                                              float(config.HTTP_READ_TIMEOUT)))
+        return response
+    finally:
+        total = time() - started
+        body = response.request.body if response is not None else None
+        elapsed = response.elapsed.total_seconds() if response is not None else total
+        trace.request(method, url, response.status_code if response is not None else None,
+                      len(response.content) if response is not None else 0,
+                      len(body or ''), started,
+                      {'dns': _TIMINGS.dns, 'connect': _TIMINGS.connect,
+                       'ttfb': max(elapsed - _TIMINGS.dns - _TIMINGS.connect, 0.0),
+                       'total': total})
 
 
 def get(url):
@@ -0,0 +1,82 @@
+"""Hosts inventory: host ips, used ports and owning services.
+Hosts are listed in bulk or fetched by id concurrently"""
+
+import json
+from . import api, http_util, shutdown, collection, config, pool, ports
+
+
+def __get_host(host_id):
+    end_point = '{}/hosts/{}'.format(api.V1, host_id)
+    response = http_util.get(end_point)
+    if response.status_code not in range(200, 300):
+        shutdown.err(response.text)
+    return json.loads(response.text)
+
+
+def fetch_hosts(host_ids=None):
+    """Get host resources. All hosts by bulk listing or given ids concurrently"""
+
+    if host_ids is None:
+        return collection.get_all('{}/hosts'.format(api.V1))
+    return pool.map_ordered(__get_host, host_ids, config.CONCURRENCY)
+
+
+def load(host_ids=None):
+    """Build inventory index of given or all hosts"""
+
+    index = {'hosts': {}, 'services': {}}
+    for host in fetch_hosts(host_ids):
+        endpoints = host.get('publicEndpoints') or []
+        ips = set(endpoint['ipAddress'] for endpoint in endpoints if endpoint.get('ipAddress'))
+        if host.get('agentIpAddress'):
+            ips.add(host['agentIpAddress'])
+        index['hosts'][host['id']] = {
+            'id': host['id'], 'name': host.get('name') or host.get('hostname'),
+            'state': host.get('state'), 'ips': sorted(ips),
+            'publicIp': endpoints[0]['ipAddress'] if endpoints else None,
+            'ports': dict((endpoint['port'], endpoint.get('serviceId'))
+                          for endpoint in endpoints)}
+        for endpoint in endpoints:
+            hosts = index['services'].setdefault(endpoint.get('serviceId'), [])
+            if host['id'] not in hosts:
+                hosts.append(host['id'])
+    index['services'].pop(None, None)
+    return index
+
+
+def host_ip(index, host_id):
+    """Host public ip"""
+
+    host = index['hosts'].get(host_id)
+    if host is None or host['publicIp'] is None:
+        shutdown.err('There is no public endpoints on host ' + host_id)
+    return host['publicIp']
+
+
+def used_ports(index, host_id):
+    """Ports published on host"""
+    return sorted(index['hosts'][host_id]['ports'].keys())
+
+
+def service_hosts(index, service_id):
+    """Hosts publishing service ports"""
+    return index['services'].get(service_id, [])
+
+
+def placement(index, start, end, count, service_id=None):
+    """Place count ports from given range over inventory hosts, hosts with more free
+    ports go first. Ports the service already publishes in range are returned first.
+    Returns [(host_id, port)]"""
+
+    assignments = []
+    ranges = {}
+    for host_id, host in sorted(index['hosts'].items()):
+        for port, port_service_id in sorted(host['ports'].items()):
+            if service_id is not None and port_service_id == service_id \
+                    and start <= port <= end and len(assignments) < count:
+                assignments.append((host_id, port))
+        ranges['host:' + host_id] = ports.port_range('host:' + host_id, start, end,
+                                                     host['ports'].keys())
+    for scope, port in ports.allocate(ranges, count - len(assignments)):
+        assignments.append((scope[len('host:'):], port))
+    return assignments
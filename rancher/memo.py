@@ -0,0 +1,119 @@
+"""Request scoped GET response memo.
+
+Inside scope() GET responses are kept by url and served again without a
+request. POST/PUT drop entries sharing a resource id or the collection
+with the written url. Waits read fresh state inside bypass(), their
+responses replace kept ones"""
+
+import contextlib
+import re
+import threading
+from . import config
+
+_ID = re.compile('^[0-9]+[a-z]+[0-9]+$')
+# v1 environments and v2-beta stacks share the id number
+_STACK_ID = re.compile('^([0-9]+)e([0-9]+)$')
+_SKIP = ('v1', 'v2-beta')
+_ALIASES = {'stack': 'environments', 'stacks': 'environments',
+            'loadbalancerservices': 'services'}
+
+_LOCK = threading.Lock()
+_SCOPES = {'depth': 0}
+_ENTRIES = {}
+_STATS = {'saved': 0, 'misses': 0, 'invalidated': 0}
+_BYPASS = threading.local()
+
+
+@contextlib.contextmanager
+def scope():
+    """Memoize GET responses of all threads within block"""
+
+    with _LOCK:
+        _SCOPES['depth'] += 1
+    try:
+        yield
+    finally:
+        with _LOCK:
+            _SCOPES['depth'] -= 1
+            if not _SCOPES['depth']:
+                _ENTRIES.clear()
+
+
+@contextlib.contextmanager
+def bypass():
+    """Send GETs of current thread within block"""
+
+    _BYPASS.depth = getattr(_BYPASS, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _BYPASS.depth -= 1
+
+
+def __normalize_id(value):
+    match = _STACK_ID.match(value)
+    return '{}st{}'.format(*match.groups()) if match else value
+
+
+def __keys(url):
+    """Resource ids and collection name of url"""
+
+    if url.startswith(config.RANCHER_BASE_URL or '\0'):
+        url = url[len(config.RANCHER_BASE_URL):]
+    path, _, query = url.partition('?')
+    segments = [segment for segment in path.strip('/').split('/') if segment]
+    if segments[:1] and segments[0] in _SKIP:
+        segments = segments[1:]
+    if segments[:1] == ['projects']:
+        segments = segments[2:]
+    ids = set(__normalize_id(segment) for segment in segments if _ID.match(segment))
+    for param in query.split('&'):
+        value = param.partition('=')[2]
+        if _ID.match(value):
+            ids.add(__normalize_id(value))
+    collection = segments[0] if segments else ''
+    return ids, _ALIASES.get(collection, collection)
+
+
+def get(url):
+    """Kept response of url or None"""
+
+    if not _SCOPES['depth'] or getattr(_BYPASS, 'depth', 0):
+        return None
+    with _LOCK:
+        entry = _ENTRIES.get(url)
+        if entry is None:
+            _STATS['misses'] += 1
+            return None
+        _STATS['saved'] += 1
+        return entry[0]
+
+
+def put(url, response):
+    """Keep successful response of url while in scope"""
+
+    if not _SCOPES['depth']:
+        return
+    with _LOCK:
+        if response.status_code in range(200, 300):
+            _ENTRIES[url] = (response,) + __keys(url)
+        else:
+            _ENTRIES.pop(url, None)
+
+
+def invalidate(url):
+    """Drop responses of resources and collection written by url"""
+
+    if not _SCOPES['depth']:
+        return
+    ids, collection = __keys(url)
+    with _LOCK:
+        for key, (_, entry_ids, entry_collection) in _ENTRIES.items():
+            if entry_ids & ids or entry_collection == collection:
+                del _ENTRIES[key]
+                _STATS['invalidated'] += 1
+
+
+def stats():
+    """Get saved requests, misses and invalidated responses counters"""
+    return dict(_STATS)
@@ -0,0 +1,165 @@
+"""Stack/service name to id resolution cache.
+Kept in memory and persisted to config.NAME_CACHE_FILE for config.NAME_CACHE_TTL seconds"""
+
+import json
+import os
+import threading
+from time import time
+from . import config
+
+_STACKS = 'stacks'
+_SERVICES = 'services'
+
+# Guards _CACHE and _STATS, deploy and upgrade workers share them
+_LOCK = threading.RLock()
+_CACHE = {}
+_STATS = {'hits': 0, 'misses': 0}
+
+
+def __enabled():
+    return int(config.NAME_CACHE_TTL) > 0
+
+
+def __scope():
+    return '{}|{}'.format(config.RANCHER_BASE_URL, config.RANCHER_PROJECT_ID)
+
+
+def __read_file():
+    if not config.NAME_CACHE_FILE or not os.path.isfile(config.NAME_CACHE_FILE):
+        return {}
+    try:
+        with open(config.NAME_CACHE_FILE) as file_object:
+            return json.load(file_object)
+    except (IOError, ValueError):
+        return {}
+
+
+def __write_file(data):
+    if not config.NAME_CACHE_FILE:
+        return
+    directory = os.path.dirname(config.NAME_CACHE_FILE)
+    tmp_path = '{}.{}.{}.tmp'.format(config.NAME_CACHE_FILE, os.getpid(),
+                                     threading.current_thread().ident)
+    try:
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(tmp_path, 'w') as file_object:
+            json.dump(data, file_object)
+        os.rename(tmp_path, config.NAME_CACHE_FILE)
+    except (IOError, OSError):
+        pass  # cache is best effort
+
+
+def __entries():
+    scope = __scope()
+    if scope not in _CACHE:
+        data = __read_file().get(scope, {})
+        now = time()
+        for kind in (_STACKS, _SERVICES):
+            data[kind] = dict((key, entry) for key, entry in data.get(kind, {}).items()
+                              if entry['expires'] > now)
+        _CACHE[scope] = data
+    return _CACHE[scope]
+
+
+def __save():
+    with _LOCK:
+        data = __read_file()
+        data[__scope()] = dict((kind, dict(entries)) for kind, entries in __entries().items())
+        __write_file(data)
+
+
+def __get(kind, key):
+    if not __enabled():
+        return None
+    with _LOCK:
+        entry = __entries()[kind].get(key)
+        if entry is None or entry['expires'] <= time():
+            _STATS['misses'] += 1
+            return None
+        _STATS['hits'] += 1
+        return entry['id']
+
+
+def __put(kind, key, value):
+    if not __enabled():
+        return
+    with _LOCK:
+        __entries()[kind][key] = {'id': value, 'expires': time() + int(config.NAME_CACHE_TTL)}
+        __save()
+
+
+def __service_key(stack_id, name):
+    return '{}/{}'.format(stack_id, name)
+
+
+def get_stack_id(name):
+    """Get cached stack id by stack name"""
+    return __get(_STACKS, name)
+
+
+def put_stack_id(name, stack_id):
+    """Cache stack id"""
+    __put(_STACKS, name, stack_id)
+
+
+def get_service_id(stack_id, name):
+    """Get cached service id by stack id and service name"""
+    return __get(_SERVICES, __service_key(stack_id, name))
+
+
+def put_service_id(stack_id, name, service_id):
+    """Cache service id"""
+    __put(_SERVICES, __service_key(stack_id, name), service_id)
+
+
+def invalidate_stack(name):
+    """Drop stack and its services from cache. Returns True if stack was cached"""
+
+    if not __enabled():
+        return False
+    with _LOCK:
+        entries = __entries()
+        stack = entries[_STACKS].pop(name, None)
+        if stack is not None:
+            prefix = __service_key(stack['id'], '')
+            for key in list(entries[_SERVICES].keys()):
+                if key.startswith(prefix):
+                    del entries[_SERVICES][key]
+            __save()
+    return stack is not None
+
+
+def invalidate_service(stack_id, name):
+    """Drop service from cache"""
+
+    if not __enabled():
+        return
+    with _LOCK:
+        if __entries()[_SERVICES].pop(__service_key(stack_id, name), None):
+            __save()
+
+
+def invalidate_url(url):
+    """Drop stacks and services whose id is in url path, request found it removed"""
+
+    if not __enabled():
+        return
+    segments = set(url.partition('?')[0].split('/'))
+    with _LOCK:
+        entries = __entries()
+        dropped = False
+        for kind in (_STACKS, _SERVICES):
+            for key, entry in list(entries[kind].items()):
+                # v1 urls name stacks environments, 1st5 is 1e5 there
+                if entry['id'] in segments or entry['id'].replace('st', 'e', 1) in segments:
+                    del entries[kind][key]
+                    dropped = True
+        if dropped:
+            __save()
+
+
+def stats():
+    """Get cache hits/misses counters"""
+    with _LOCK:
+        return dict(_STATS)
@@ -0,0 +1,58 @@
+"""Bounded thread pool helpers for concurrent API calls"""
+
+import sys
+import threading
+import Queue
+
+
+def imap_unordered(func, items, workers):
+    """Apply func to items in up to workers threads. Yields (item, result) as they finish.
+    Exception raised by func (shutdown included) is re-raised in caller"""
+
+    items = list(items)
+    tasks = Queue.Queue()
+    done = Queue.Queue()
+    for item in items:
+        tasks.put(item)
+
+    def worker():
+        while True:
+            try:
+                item = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                done.put((item, func(item), None))
+            except BaseException:  # pylint: disable=broad-except
+                done.put((item, None, sys.exc_info()))
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(max(1, min(int(workers), len(items))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        for _ in items:
+            item, result, error = done.get()
+            if error is not None:
+                raise error[0], error[1], error[2]
+            yield item, result
+    finally:
+        # Let running calls finish without starting new ones
+        while not tasks.empty():
+            try:
+                tasks.get_nowait()
+            except Queue.Empty:
+                break
+        for thread in threads:
+            thread.join()
+
+
+def map_ordered(func, items, workers):
+    """Apply func to items in up to workers threads. Returns results in items order"""
+
+    items = list(items)
+    results = dict((index, result) for index, result in imap_unordered(
+        lambda index: func(items[index]), range(len(items)), workers))
+    return [results[index] for index in range(len(items))]
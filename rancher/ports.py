@@ -0,0 +1,102 @@
+"""Port occupancy bitmaps and allocation.
+Allocated ports stay reserved in process, so allocations of one batch never collide"""
+
+import heapq
+import threading
+
+_RESERVED = {}
+_LOCK = threading.Lock()
+
+
+class PortRange(object):
+    """Occupancy bitmap of start..end ports range"""
+
+    def __init__(self, start, end, used=()):
+        self.start = start
+        self.end = end
+        self.bits = bytearray((end - start) / 8 + 1)
+        self.used = 0
+        self.hint = 0
+        for port in used:
+            self.mark(port)
+
+    def __contains__(self, port):
+        return self.start <= port <= self.end
+
+    def is_free(self, port):
+        """Port is in range and not used"""
+        offset = port - self.start
+        return port in self and not self.bits[offset >> 3] & (1 << (offset & 7))
+
+    def mark(self, port):
+        """Mark port as used. Ports out of range are ignored"""
+        if self.is_free(port):
+            offset = port - self.start
+            self.bits[offset >> 3] |= 1 << (offset & 7)
+            self.used += 1
+
+    def free_count(self):
+        """Count of free ports"""
+        return self.end - self.start + 1 - self.used
+
+    def take(self, count):
+        """Mark and return up to count lowest free ports"""
+
+        ports = []
+        # Bytes before hint are full
+        while self.hint < len(self.bits) and self.bits[self.hint] == 0xff:
+            self.hint += 1
+        for index in range(self.hint, len(self.bits)):
+            byte = self.bits[index]
+            if byte == 0xff:
+                continue
+            for bit in range(8):
+                port = self.start + (index << 3) + bit
+                if len(ports) == count or port > self.end:
+                    break
+                if not byte & (1 << bit):
+                    ports.append(port)
+            if len(ports) == count:
+                break
+        for port in ports:
+            self.mark(port)
+        return ports
+
+
+def port_range(scope, start, end, used=()):
+    """Range with used and already reserved in scope ports marked"""
+    with _LOCK:
+        reserved = list(_RESERVED.get(scope, ()))
+    return PortRange(start, end, list(used) + reserved)
+
+
+def reserve(scope, ports):
+    """Hold ports of scope for the rest of the process"""
+    with _LOCK:
+        _RESERVED.setdefault(scope, set()).update(ports)
+
+
+def clear():
+    """Release all reservations"""
+    with _LOCK:
+        _RESERVED.clear()
+
+
+def allocate(ranges, count):
+    """Allocate count ports spreading them over scopes with most free ports.
+    Ranges are PortRange by scope. Returns [(scope, port)], shorter when ports run out"""
+
+    heap = [(-port_set.free_count(), scope) for scope, port_set in ranges.items()
+            if port_set.free_count() > 0]
+    heapq.heapify(heap)
+    assignments = []
+    while heap and len(assignments) < count:
+        _, scope = heapq.heappop(heap)
+        port_set = ranges[scope]
+        assignments.extend((scope, port) for port in port_set.take(1))
+        if port_set.free_count() > 0:
+            heapq.heappush(heap, (-port_set.free_count(), scope))
+
+    for scope in set(scope for scope, _ in assignments):
+        reserve(scope, [port for port_scope, port in assignments if port_scope == scope])
+    return assignments
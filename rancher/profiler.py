@@ -0,0 +1,93 @@
+"""Run a function under cProfile or a sampling profiler.
+
+cprofile writes pstats file (python -m pstats, snakeviz, gprof2dot).
+sample interrupts every INTERVAL seconds of process cpu time, records stacks
+of all threads and writes them collapsed, one "frame;frame;frame count" line
+per stack, ready for flamegraph.pl or speedscope.
+Both print top functions to stderr"""
+
+import cProfile
+import os
+import pstats
+import signal
+import sys
+import threading
+
+CPROFILE = 'cprofile'
+SAMPLE = 'sample'
+PROFILERS = (CPROFILE, SAMPLE)
+
+INTERVAL = 0.005
+TOP = 20
+
+
+def run(func, path, profiler=CPROFILE, top=TOP):
+    """Call func under profiler, write profile to path and print top functions.
+    Returns func result, profile is written also when func raises"""
+
+    if profiler == SAMPLE:
+        return __run_sampling(func, path, top)
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func)
+    finally:
+        profile.dump_stats(path)
+        stats = pstats.Stats(profile, stream=sys.stderr)
+        sys.stderr.write('Profile written to {}\n'.format(path))
+        stats.sort_stats('cumulative').print_stats(top)
+        stats.sort_stats('tottime').print_stats(top)
+
+
+def __frame_name(frame):
+    code = frame.f_code
+    return '{}:{}:{}'.format(os.path.basename(code.co_filename), code.co_name, code.co_firstlineno)
+
+
+def __run_sampling(func, path, top):
+    stacks = {}
+    own_thread = threading.current_thread().ident
+    # Frames below func call are the profiler's own
+    own_frame = sys._getframe()  # pylint: disable=protected-access
+
+    def sample(_, frame):
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        for thread_id, thread_frame in frames.items():
+            # Handler runs in main thread on top of interrupted frame
+            if thread_id == own_thread:
+                thread_frame = frame
+            names = []
+            while thread_frame is not None and thread_frame is not own_frame:
+                names.append(__frame_name(thread_frame))
+                thread_frame = thread_frame.f_back
+            key = ';'.join(reversed(names))
+            stacks[key] = stacks.get(key, 0) + 1
+
+    previous = signal.signal(signal.SIGPROF, sample)
+    signal.setitimer(signal.ITIMER_PROF, INTERVAL, INTERVAL)
+    try:
+        return func()
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, previous)
+        with open(path, 'w') as output:
+            for key, count in sorted(stacks.items()):
+                output.write('{} {}\n'.format(key, count))
+        __print_samples(stacks, path, top)
+
+
+def __print_samples(stacks, path, top):
+    total = sum(stacks.values())
+    own = {}
+    inclusive = {}
+    for key, count in stacks.items():
+        names = key.split(';')
+        own[names[-1]] = own.get(names[-1], 0) + count
+        for name in set(names):
+            inclusive[name] = inclusive.get(name, 0) + count
+
+    sys.stderr.write('Collapsed stacks written to {}, {} samples every {}s of cpu time\n'
+                     .format(path, total, INTERVAL))
+    sys.stderr.write('{:>7} {:>7}  {}\n'.format('own%', 'total%', 'function'))
+    for name, count in sorted(own.items(), key=lambda item: -item[1])[:top]:
+        sys.stderr.write('{:>6.1f}% {:>6.1f}%  {}\n'.format(
+            100.0 * count / total, 100.0 * inclusive[name] / total, name))
@@ -0,0 +1,183 @@
+"""Api request rate limit, retries and circuit breaker.
+
+Token bucket of config.HTTP_RATE_LIMIT requests per second with
+config.HTTP_RATE_BURST tokens is shared by all threads, 0 disables it.
+
+Failed requests are retried config.HTTP_RETRIES times after exponential
+backoff with full jitter from config.HTTP_RETRY_BACKOFF seconds up to
+config.HTTP_RETRY_MAX_BACKOFF, Retry-After is honored. GET and PUT are
+retried on connection errors, timeouts and 429/500/502/503/504. POST is not
+idempotent, so only when the request surely did not reach the api: connect
+errors, 429 and 503.
+
+config.CIRCUIT_FAILURES failed requests in a row open the circuit: requests
+are not sent for config.CIRCUIT_RESET seconds, then one probe decides to
+close it or open it again. Waiting out an open circuit counts as a retry"""
+
+import random
+import threading
+from time import sleep, time
+import requests
+from . import config, trace
+
+_IDEMPOTENT = ('get', 'put')
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Answered before the action is taken
+_POST_RETRY_STATUSES = (429, 503)
+
+_CLOSED = 'closed'
+_OPEN = 'open'
+_HALF_OPEN = 'half-open'
+
+_LOCK = threading.Lock()
+_BUCKET = {'tokens': None, 'updated': 0.0}
+_CIRCUIT = {'state': _CLOSED, 'failures': 0, 'opened': 0.0, 'probing': False}
+_STATS = {'limited': 0, 'limitedSeconds': 0.0, 'retries': 0, 'backoffSeconds': 0.0,
+          'circuitOpened': 0, 'shortCircuited': 0, 'failed': 0}
+
+
+class CircuitOpen(Exception):
+    """Request is not sent while circuit is open"""
+
+    def __init__(self, remaining):
+        super(CircuitOpen, self).__init__('Rancher api circuit is open')
+        self.remaining = remaining
+
+
+def __count(name, value=1):
+    with _LOCK:
+        _STATS[name] += value
+
+
+def acquire():
+    """Take a token, sleep while bucket is empty"""
+
+    rate = float(config.HTTP_RATE_LIMIT or 0)
+    if rate <= 0:
+        return
+    burst = max(float(config.HTTP_RATE_BURST or 1), 1.0)
+    with _LOCK:
+        now = time()
+        if _BUCKET['tokens'] is None:
+            _BUCKET['tokens'] = burst
+        else:
+            _BUCKET['tokens'] = min(burst, _BUCKET['tokens'] + (now - _BUCKET['updated']) * rate)
+        _BUCKET['updated'] = now
+        # Token is reserved now, so waiting threads are served in order
+        _BUCKET['tokens'] -= 1
+        pause = -_BUCKET['tokens'] / rate if _BUCKET['tokens'] < 0 else 0.0
+        if pause:
+            _STATS['limited'] += 1
+            _STATS['limitedSeconds'] += pause
+    if pause:
+        __sleep('rate limit', pause)
+
+
+def allow():
+    """Raise CircuitOpen unless request may be sent"""
+
+    with _LOCK:
+        if _CIRCUIT['state'] == _CLOSED:
+            return
+        remaining = _CIRCUIT['opened'] + float(config.CIRCUIT_RESET) - time()
+        if _CIRCUIT['state'] == _OPEN and remaining <= 0:
+            _CIRCUIT['state'] = _HALF_OPEN
+        if _CIRCUIT['state'] == _HALF_OPEN and not _CIRCUIT['probing']:
+            _CIRCUIT['probing'] = True
+            return
+        _STATS['shortCircuited'] += 1
+    raise CircuitOpen(max(remaining, 0.0))
+
+
+def record(failed):
+    """Count request outcome for circuit"""
+
+    threshold = int(config.CIRCUIT_FAILURES or 0)
+    with _LOCK:
+        _CIRCUIT['probing'] = False
+        if not failed:
+            _CIRCUIT['state'] = _CLOSED
+            _CIRCUIT['failures'] = 0
+            return
+        _CIRCUIT['failures'] += 1
+        if threshold > 0 and (_CIRCUIT['state'] == _HALF_OPEN
+                              or _CIRCUIT['failures'] >= threshold):
+            if _CIRCUIT['state'] != _OPEN:
+                _STATS['circuitOpened'] += 1
+            _CIRCUIT['state'] = _OPEN
+            _CIRCUIT['opened'] = time()
+
+
+def unhealthy(response):
+    """Response tells api is overloaded or failing"""
+    return response.status_code in _RETRY_STATUSES
+
+
+def __connect_error(error):
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError):
+        return False
+    reason = getattr(error.args[0] if error.args else None, 'reason', None)
+    # Connection refused or name not resolved, request was not sent
+    return type(reason).__name__ in ('NewConnectionError', 'ConnectTimeoutError')
+
+
+def retryable(method, response=None, error=None):
+    """Failed attempt may be repeated"""
+
+    if isinstance(error, CircuitOpen):
+        return True
+    if method in _IDEMPOTENT:
+        if error is not None:
+            return isinstance(error, (requests.exceptions.ConnectionError,
+                                      requests.exceptions.Timeout))
+        return response.status_code in _RETRY_STATUSES
+    if error is not None:
+        return __connect_error(error)
+    return response.status_code in _POST_RETRY_STATUSES
+
+
+def __retry_after(response):
+    value = response.headers.get('Retry-After') if response is not None else None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return 0.0  # http date form is not used by rancher
+
+
+def backoff(attempt, response=None, error=None):
+    """Sleep before retry attempt (1 based)"""
+
+    limit = float(config.HTTP_RETRY_MAX_BACKOFF)
+    pause = random.uniform(0, min(limit, float(config.HTTP_RETRY_BACKOFF) * 2 ** (attempt - 1)))
+    if isinstance(error, CircuitOpen):
+        pause = max(pause, error.remaining)
+    pause = min(max(pause, __retry_after(response)), limit)
+    with _LOCK:
+        _STATS['retries'] += 1
+        _STATS['backoffSeconds'] += pause
+    __sleep('retry backoff', pause)
+
+
+def give_up():
+    """Count request failed after all retries"""
+    __count('failed')
+
+
+def __sleep(name, pause):
+    started = time()
+    sleep(pause)
+    if trace.enabled():
+        trace.span(name, started, time() - started, pause)
+
+
+def stats():
+    """Get rate limit waits, retries and circuit breaker counters"""
+
+    with _LOCK:
+        result = dict(_STATS)
+        result['circuit'] = _CIRCUIT['state']
+    result['limitedSeconds'] = round(result['limitedSeconds'], 3)
+    result['backoffSeconds'] = round(result['backoffSeconds'], 3)
+    return result
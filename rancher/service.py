@@ -1,19 +1,51 @@
 """Service operations"""
 
+import copy
 import json
-from time import sleep, time
-from . import stack, shutdown, api, http_util, config
+from collections import OrderedDict
+from time import time
+from urllib import quote
+from . import stack, shutdown, api, http_util, config, name_cache, collection, waiter
+
+_WAIT_TIMEOUT = 360
+_DELETE = '$delete'
+_OK = 'ok'
+_FAILED = 'failed'
+
+# Rancher in-service upgrade strategy defaults
+UPGRADE_BATCH_SIZE = 1
+UPGRADE_INTERVAL_MILLIS = 2000
+UPGRADE_START_FIRST = False
+
+# List identity fields for merge by dotted path
+MERGE_KEYS = {'lbConfig.portRules': ('protocol', 'hostname', 'sourcePort', 'path')}
+
 
 def __get_service_id(stack_id, name, no_error=False):
+    service_id = name_cache.get_service_id(stack_id, name)
+    if service_id is not None:
+        return service_id
+
     end_point = '{}/environments/{}/services'.format(api.V1, stack_id)
-    response = http_util.get(end_point)
-    if response.status_code not in range(200, 300):
-        shutdown.err(response.text)
+    response = None
+    if config.API_FILTERS:
+        filtered_end_point = '{}?name={}&removed_null=1'.format(end_point, quote(name))
+        response = collection.get_page(filtered_end_point)
+        if response.status_code in range(200, 300) + [404]:
+            end_point = filtered_end_point
+        else:
+            # Full scan fallback for API servers rejecting filters
+            response = None
+    if response is None:
+        response = collection.get_page(end_point)
+    if response.status_code == 404 and no_error:
+        return None
 
-    data = json.loads(response.text)['data']
-    for service in data:
+    for service in collection.iterate(end_point, response):
         if 'name' in service and service['name'] == name:
+            name_cache.put_service_id(stack_id, name, service['id'])
             return service['id']
+
     if not no_error:
         shutdown.err('No such service ' + name)
     else:
@@ -23,10 +55,7 @@ def get_service_instances(service_id):
     """Get service instances"""
 
     end_point = '{}/services/{}/instances'.format(api.V1, service_id)
-    response = http_util.get(end_point)
-    if response.status_code not in range(200, 300):
-        shutdown.err(response.text)
-    instances = json.loads(response.text)['data']
+    instances = collection.get_all(end_point)
     if not instances:
         shutdown.err('No instances for service ' + service_id)
     return instances
@@ -39,60 +68,131 @@ def parse_service_id(host_name, no_error=False):
     stack_id = stack.get_stack_id(stack_name, no_error)
     if stack_id is None:
         return None
-    service_id = __get_service_id(stack_id, service_name)
+    service_id = __get_service_id(stack_id, service_name, True)
+    if service_id is None and name_cache.invalidate_stack(stack_name):
+        # Cached stack id could be stale, resolve it again
+        stack_id = stack.get_stack_id(stack_name, no_error)
+        if stack_id is None:
+            return None
+        service_id = __get_service_id(stack_id, service_name, True)
     if service_id is None:
-        return None
-    else:
-        return service_id
+        shutdown.err('No such service ' + service_name)
+    return service_id
 
 def upgrade(host_name, data=None):
-    """Upgrade service"""
-    service_id = parse_service_id(host_name)
-    __init_upgrade(service_id, data)
-    __wait_for_upgrade(service_id)
-    __wait_for_healthy(service_id)
+    """Upgrade service in place, see upgrade_service"""
+    return upgrade_service(parse_service_id(host_name), data)
+
+
+def upgrade_service(service_id, data=None):
+    """Upgrade service in place and finish upgrade once it is healthy.
+    data holds launchConfig updates and in-service strategy fields (batchSize,
+    intervalMillis, startFirst, secondaryLaunchConfigs). Returns seconds taken"""
+
+    started = time()
+    __init_upgrade(service_id, data or {})
+    resource = __wait_for_upgrade(service_id)
+    __wait_for_healthy(service_id, resource)
     __finish_upgrade(service_id)
+    __wait_for_active(service_id)
+    return round(time() - started, 3)
+
+
+def upgrade_services(targets, workers=4):
+    """Upgrade services concurrently, at most workers at once.
+    targets maps service id to its upgrade data. Returns {service id: result}
+    with status ok or failed, error and seconds"""
+
+    from . import pool
+
+    def upgrade_target(service_id):
+        result = {'serviceId': service_id, 'status': _OK, 'error': None, 'seconds': None}
+        try:
+            result['seconds'] = upgrade_service(service_id, targets[service_id])
+        except shutdown.Shutdown as ex:
+            if ex.code:
+                result['status'] = _FAILED
+                result['error'] = ex.text
+        except Exception as ex:  # pylint: disable=broad-except
+            result['status'] = _FAILED
+            result['error'] = repr(ex)
+        return result
+
+    return dict(pool.imap_unordered(upgrade_target, targets.keys(), workers))
+
+
+def select_services(selector):
+    """Ids of services matching selector: comma separated stack=<name> and
+    launch config label=value pairs"""
+
+    pairs = dict(pair.split('=', 1) for pair in selector.split(',') if '=' in pair)
+    stack_name = pairs.pop('stack', None)
+    if stack_name is not None:
+        end_point = '{}/environments/{}/services'.format(api.V1, stack.get_stack_id(stack_name))
+    else:
+        end_point = '{}/services?removed_null=1'.format(api.V1)
+    service_ids = []
+    for service in collection.iterate(end_point):
+        labels = (service.get('launchConfig') or {}).get('labels') or {}
+        if service.get('removed') is None and \
+                all(labels.get(key) == value for key, value in pairs.items()):
+            service_ids.append(service['id'])
+    return service_ids
+
 
 def __init_upgrade(service_id, data):
-    payload = __get(service_id)
-    if data is not None:
-        payload.update(data)
+    service = __get(service_id)
+    strategy = {'launchConfig': __updated(service.get('launchConfig') or {},
+                                          data.get('launchConfig') or {}),
+                'secondaryLaunchConfigs': data.get('secondaryLaunchConfigs',
+                                                   service.get('secondaryLaunchConfigs') or []),
+                'batchSize': int(data.get('batchSize', UPGRADE_BATCH_SIZE)),
+                'intervalMillis': int(data.get('intervalMillis', UPGRADE_INTERVAL_MILLIS)),
+                'startFirst': bool(data.get('startFirst', UPGRADE_START_FIRST))}
     end_point = '{}/services/{}/?action=upgrade'.format(api.V1, service_id)
-    response = http_util.post(end_point, data)
+    response = http_util.post(end_point, {'inServiceStrategy': strategy})
     if response.status_code not in range(200, 300):
         shutdown.err(response.text)
 
+def __updated(left, right):
+    """Copy of left with right values set, nested dicts updated key by key"""
+
+    result = copy.deepcopy(left)
+    for key, value in right.items():
+        if isinstance(result.get(key), dict) and isinstance(value, dict):
+            result[key] = __updated(result[key], value)
+        else:
+            result[key] = value
+    return result
+
 def __finish_upgrade(service_id):
-    end_point = '{}services/{}/?action=finishupgrade'.format(
+    end_point = '{}/services/{}/?action=finishupgrade'.format(
         api.V1, service_id)
     response = http_util.post(end_point, {})
     if response.status_code not in range(200, 300):
         shutdown.err(response.text)
 
-def __wait_for_upgrade(service_id):
-    timeout = 360
-    stop_time = int(time()) + timeout
-    state = None
-    while int(time()) <= stop_time:
-        state = __get_state(service_id)
-        if state == 'upgraded':
-            return
-        sleep(5)
-    shutdown.err(
-        'Timeout while waiting to service upgrade. Current state is: ' + state)
-
-def __wait_for_healthy(service_id):
-    timeout = 360
-    stop_time = int(time()) + timeout
-    health_state = None
-    while int(time()) <= stop_time:
-        health_state = __get_health_state(service_id)
-        if health_state == 'healthy':
-            return
-        sleep(5)
-    shutdown.err(
-        'Timeout while waiting to service become healthy. Current health state is: '
-        + health_state)
+def __wait_for_upgrade(service_id, resource=None):
+    return waiter.wait(lambda: __get(service_id), 'service upgrade',
+                       lambda service: service['state'] == 'upgraded',
+                       _WAIT_TIMEOUT, resource, [service_id], __diagnoser(service_id),
+                       check_health=False)
+
+def __wait_for_healthy(service_id, resource=None):
+    return waiter.wait(lambda: __get(service_id), 'service become healthy',
+                       lambda service: service['healthState'] == 'healthy',
+                       _WAIT_TIMEOUT, resource, [service_id], __diagnoser(service_id))
+
+def __wait_for_active(service_id, resource=None):
+    return waiter.wait(lambda: __get(service_id), 'service become active',
+                       lambda service: service['state'] == 'active',
+                       _WAIT_TIMEOUT, resource, [service_id], __diagnoser(service_id))
+
+def __diagnoser(service_id):
+    from . import container
+    start_counts = {}
+    return lambda resource: container.diagnose_service_instances(service_id, start_counts)
+
 
 def __get(service_id):
     end_point = '{}/services/{}'.format(api.V1, service_id)
@@ -109,43 +209,75 @@ def __get_lb_service(service_id):
         shutdown.err(response.text)
     return json.loads(response.text)
 
-def __get_state(service_id):
-    service = __get(service_id)
-    return service['state']
-
-def __get_health_state(service_id):
-    service = __get(service_id)
-    return service['healthState']
-
-def update_load_balancer_service(service_id, data):
-    """Update load balancer target"""
+def update_load_balancer_service(service_id, data, keys=None):
+    """Update load balancer target. PUT is skipped when merge changes nothing.
+    Returns config diff"""
 
+    from . import diff_util
     lb_config = __get_lb_service(service_id)
-    payload = merge(lb_config, data)
+    payload = merge(copy.deepcopy(lb_config), data, keys=keys)
+    changes = diff_util.diff(lb_config, payload)
+    if not changes:
+        return changes
     end_point = '{}/projects/{}/loadbalancerservices/{}'.format(
         api.V2_BETA, config.RANCHER_PROJECT_ID, service_id)
     response = http_util.put(end_point, payload)
     if response.status_code not in range(200, 300):
         shutdown.err(response.text)
+    return changes
 
-def merge(left, right, path=None):
-    """Merge dicts"""
+def merge(left, right, path=None, keys=None):
+    """Merge dicts. Lists at keys paths (default MERGE_KEYS) are upserted by item
+    identity fields, right items with "$delete": true remove the matching item.
+    Other lists get missing right items appended"""
 
     if path is None:
         path = []
+    if keys is None:
+        keys = MERGE_KEYS
     for key in right:
+        key_path = path + [str(key)]
+        identity = keys.get('.'.join(key_path))
         if key in left:
             if isinstance(left[key], dict) and isinstance(right[key], dict):
-                merge(left[key], right[key], path + [str(key)])
+                merge(left[key], right[key], key_path, keys)
             elif left[key] == right[key]:
                 pass  # same leaf value
             elif isinstance(left[key], list) and isinstance(right[key], list):
-                for item in right[key]:
-                    if item not in left[key]:
-                        left[key].append(item)
+                if identity:
+                    left[key] = __merge_keyed(left[key], right[key], identity)
+                else:
+                    __merge_list(left[key], right[key])
             else:
-                raise Exception('Conflict at %s' %
-                                '.'.join(path + [str(key)]))
+                raise Exception('Conflict at %s' % '.'.join(key_path))
+        elif identity and isinstance(right[key], list):
+            left[key] = __merge_keyed([], right[key], identity)
         else:
             left[key] = right[key]
     return left
+
+
+def __merge_list(left, right):
+    seen = set(json.dumps(item, sort_keys=True) for item in left)
+    for item in right:
+        item_key = json.dumps(item, sort_keys=True)
+        if item_key not in seen:
+            seen.add(item_key)
+            left.append(item)
+
+
+def __merge_keyed(left, right, identity):
+    """Upsert right items into left by identity fields. Left duplicates are dropped"""
+
+    index = OrderedDict()
+    for item in left:
+        index.setdefault(tuple(item.get(field) for field in identity), item)
+    for item in right:
+        item_key = tuple(item.get(field) for field in identity)
+        if item.get(_DELETE):
+            index.pop(item_key, None)
+        elif item_key in index:
+            index[item_key] = dict(index[item_key], **item)
+        else:
+            index[item_key] = item
+    return index.values()
@@ -2,24 +2,31 @@
 
 import json
 import re
-from . import shutdown, http_util, api, config
+from . import shutdown, http_util, api, config, collection, diff_util, ports, memo
 
+_NUMERIC_PORT = re.compile("^\\d+=\\d+$")
 
-def __get_load_balancer_targets():
-    services = get_load_balancer_services()
+
+def __get_consume_maps():
+    if config.API_FILTERS:
+        end_point = '{}/serviceconsumemaps?serviceId={}&removed_null=1'.format(
+            api.V1, config.LOAD_BALANCER_SVC_ID)
+        response = collection.get_page(end_point)
+        if response.status_code in range(200, 300):
+            return collection.iterate(end_point, response), None
+
+    # Full scan fallback for API servers rejecting filters
     service_ids = []
-    for svc in services:
+    for svc in get_load_balancer_services():
         service_ids.append(svc['id'])
+    return collection.iterate('{}/serviceconsumemaps'.format(api.V1)), service_ids
 
-    end_point = '{}/serviceconsumemaps?limit=-1'.format(api.V1)
-    response = http_util.get(end_point)
-    if response.status_code not in range(200, 300):
-        shutdown.err(response.text)
 
-    data = json.loads(response.text)['data']
+def __get_load_balancer_targets():
+    data, service_ids = __get_consume_maps()
     services = []
     for item in data:
-        if item['consumedServiceId'] in service_ids \
+        if (service_ids is None or item['consumedServiceId'] in service_ids) \
                 and 'ports' in item and item['ports'] is not None:
             services.append(
                 {'serviceId': item['consumedServiceId'],
@@ -38,7 +45,8 @@ def __get_load_balancer_ports(lb_svc_id):
 
 
 def __set_load_balancer_targets(targets):
-    payload = {'serviceLinks': targets}
+    payload = {'serviceLinks': [{'serviceId': target['serviceId'], 'ports': target['ports']}
+                                for target in targets]}
     end_point = '{}/loadbalancerservices/{}/?action=setservicelinks'.format(
         api.V1, config.LOAD_BALANCER_SVC_ID)
     response = http_util.post(end_point, payload)
@@ -46,76 +54,138 @@ def __set_load_balancer_targets(targets):
         shutdown.err(response.text)
 
 
-def add_load_balancer_target(svc_id, host, desired_port, internal_port):
-    """Add load balancer port"""
+def __get_load_balancer_tcp_ports():
+    """TCP ports published by load balancer, like 5432:5432/tcp"""
+
+    end_point = '{}/loadbalancerservices/{}'.format(api.V1, config.LOAD_BALANCER_SVC_ID)
+    response = http_util.get(end_point)
+    if response.status_code not in range(200, 300):
+        shutdown.err(response.text)
+
+    data = json.loads(response.text)
+    return (data.get('launchConfig') or {}).get('ports') or []
 
-    port_set = False
-    targets = __get_load_balancer_targets()
-    tcp_ports = __get_load_balancer_ports(svc_id)
 
+def __links(targets):
+    """Service ports by service id"""
+
+    links = {}
+    for target in targets:
+        if target['state'] != 'removed':
+            links.setdefault(target['serviceId'], []).extend(target['ports'])
+    return links
+
+
+def __add_target(targets, tcp_ports, link):
+    """Add link port to targets. Returns None or reason why link is skipped"""
+
+    svc_id = str(link['serviceId'])
+    host = link['host']
+    desired_port = link['externalPort']
+    internal_port = link['internalPort']
+    if str(desired_port) + ':' + str(desired_port) + '/tcp' in tcp_ports:
+        new_port = str(desired_port) + '=' + str(internal_port)
+    else:
+        new_port = host + ':' + str(desired_port) + '=' + str(internal_port)
+
+    matched = [target for target in targets if target['serviceId'] == svc_id]
+    for target in matched:
+        for port in target['ports']:
+            if port.lower().startswith(host.lower() + ':' + str(desired_port)) \
+                    or (port.endswith('=' + str(internal_port)) and
+                            _NUMERIC_PORT.match(port) is not None):
+                return 'This target already exists: ' + str(target)
+    for target in matched:
+        target['ports'].append(new_port)
+    if not matched:
+        targets.append({'serviceId': svc_id, 'ports': [new_port], 'state': 'active'})
+    return None
+
+
+def __remove_target(targets, link):
+    """Remove link port from targets. Returns None or reason why link is skipped"""
+
+    svc_id = str(link['serviceId'])
+    host = link['host']
+    desired_port = link['externalPort']
+    port_removed = False
     for idx, target in reversed(list(enumerate(targets))):
-        if target['state'] == 'removed':
-            del targets[idx]
+        if target['serviceId'] != svc_id:
             continue
-        if target['serviceId'] == str(svc_id) and 'ports' in target:
-            for port in target['ports']:
-                if port.lower().startswith(host.lower() + ':' + str(desired_port)) \
-                        or (port.endswith('=' + str(internal_port)) and
-                                re.compile("^\\d+=\\d+$").match(port) is not None):
-                    shutdown.info(
-                        'This target already exists: ' + str(target))
-
-            if str(desired_port) + ':' + str(desired_port) + '/tcp' in tcp_ports:
-                target['ports'].append(
-                    str(desired_port) + '=' + str(internal_port))
-            else:
-                target['ports'].append(
-                    host + ':' + str(desired_port) + '=' + str(internal_port))
-
-            port_set = True
-            targets[idx] = target
-    if not port_set:
-        if str(desired_port) + ':' + str(desired_port) + '/tcp' in tcp_ports:
-            targets.append(
-                {'serviceId': str(svc_id),
-                 'ports': [str(desired_port) + '=' + str(internal_port)]})
+        # Rancher can create duplicate ports, so all matching ports are removed.
+        # https://github.com/rancher/rancher/issues/4631
+        ports = [port for port in target['ports']
+                 if not (port.lower().startswith(host.lower() + ':' + str(desired_port))
+                         or (port.startswith(str(desired_port) + '=')
+                             and _NUMERIC_PORT.match(port) is not None))]
+        if len(ports) == len(target['ports']):
+            continue
+        port_removed = True
+        if ports:
+            target['ports'] = ports
+        else:
+            del targets[idx]
+    return None if port_removed else 'No such target'
+
+
+def update_load_balancer_targets(additions, removals):
+    """Apply many link removals and additions with a single setservicelinks and update.
+    Links are dicts with serviceId, host, externalPort and internalPort (additions only).
+    Links are re-read before the write and changes are applied again when another
+    client modified them in between. Nothing is written when links are unchanged.
+    Returns applied and skipped links and links diff"""
+
+    for attempt in range(int(config.LINK_UPDATE_ATTEMPTS)):
+        if attempt:
+            # Memoized links are the stale ones that did not match
+            with memo.bypass():
+                snapshot = __get_load_balancer_targets()
+                tcp_ports = __get_load_balancer_tcp_ports() if additions else []
         else:
-            targets.append(
-                {'serviceId': str(svc_id),
-                 'ports': [host + ':' + str(desired_port) + '=' + str(internal_port)]})
-    __set_load_balancer_targets(targets)
-    __update_load_balancer_service()
+            snapshot = __get_load_balancer_targets()
+            tcp_ports = __get_load_balancer_tcp_ports() if additions else []
+        targets = [{'serviceId': target['serviceId'], 'ports': list(target['ports']),
+                    'state': target['state']}
+                   for target in snapshot if target['state'] != 'removed']
+        report = {'added': [], 'removed': [], 'skipped': []}
+        for link in removals:
+            reason = __remove_target(targets, link)
+            report['skipped' if reason else 'removed'].append(dict(link, reason=reason))
+        for link in additions:
+            reason = __add_target(targets, tcp_ports, link)
+            report['skipped' if reason else 'added'].append(dict(link, reason=reason))
+        report['diff'] = diff_util.diff(__links(snapshot), __links(targets))
+        if not report['diff']:
+            return report  # nothing to change, skip load balancer reload
+
+        with memo.bypass():
+            current = __get_load_balancer_targets()
+        if diff_util.diff(__links(snapshot), __links(current)):
+            continue  # modified concurrently, apply changes to fresh links
+        __set_load_balancer_targets(targets)
+        __update_load_balancer_service()
+        return report
+    shutdown.err('Load balancer links are modified concurrently, giving up after {} attempts'
+                 .format(config.LINK_UPDATE_ATTEMPTS))
+
+
+def add_load_balancer_target(svc_id, host, desired_port, internal_port):
+    """Add load balancer port"""
+
+    report = update_load_balancer_targets(
+        [{'serviceId': svc_id, 'host': host, 'externalPort': desired_port,
+          'internalPort': internal_port}], [])
+    if report['skipped']:
+        shutdown.info(report['skipped'][0]['reason'])
 
 
 def remove_load_balancer_target(svc_id, host, desired_port):
     """Remove load balancer target"""
 
-    port_removed = False
-    targets = __get_load_balancer_targets()
-    for idx, target in reversed(list(enumerate(targets))):
-        if target['state'] == 'removed':
-            del targets[idx]
-            continue
-        if target['serviceId'] == str(svc_id) and 'ports' in target:
-            for port in target['ports']:
-                if port.lower().startswith(host.lower() + ':' + str(desired_port)) \
-                        or (port.startswith(str(desired_port) + '=')
-                                and re.compile("^\\d+=\\d+$").match(port) is not None):
-                    target['ports'].remove(port)
-                    port_removed = True
-                    if len(target['ports']) > 0:
-                        targets[idx] = target
-                    else:
-                        del targets[idx]
-                        # Commented break. It because rancher can create duplicate ports.
-                        # https://github.com/rancher/rancher/issues/4631
-                        # break
-                        # if port_removed:
-                        # break
-    if not port_removed:
-        shutdown.info('No such target')
-    __set_load_balancer_targets(targets)
-    __update_load_balancer_service()
+    report = update_load_balancer_targets(
+        [], [{'serviceId': svc_id, 'host': host, 'externalPort': desired_port}])
+    if report['skipped']:
+        shutdown.info(report['skipped'][0]['reason'])
 
 
 def __update_load_balancer_service():
@@ -128,17 +198,29 @@ def __update_load_balancer_service():
 
 def get_available_port(lb_svc_id, ports_start, ports_end, svc_id=None):
     """Get available port"""
+    return get_available_ports(lb_svc_id, ports_start, ports_end, 1, svc_id)[0]
+
+
+def get_available_ports(lb_svc_id, ports_start, ports_end, count, svc_id=None):
+    """Get count available load balancer tcp ports. Ports of svc_id go first"""
+
+    available = []
+    used = []
+    for port in __get_load_balancer_ports(lb_svc_id):
+        if port['protocol'] == 'tcp':
+            used.append(port['sourcePort'])
+            if svc_id is not None and port['serviceId'] == svc_id \
+                    and ports_start <= port['sourcePort'] <= ports_end \
+                    and len(available) < count:
+                available.append(port['sourcePort'])
 
-    available_range = range(ports_start, ports_end + 1)
-    ports = __get_load_balancer_ports(lb_svc_id)
-    for port in ports:
-        if port['protocol'] == 'tcp' and port['sourcePort'] in available_range:
-            if port['serviceId'] == svc_id:
-                return port['sourcePort']
-            available_range.remove(port['sourcePort'])
-    if len(available_range) > 0:
-        return available_range[0]
-    shutdown.err('There is no available ports')
+    scope = 'lb:' + lb_svc_id
+    port_range = ports.port_range(scope, ports_start, ports_end, used)
+    available.extend(port for _, port in ports.allocate({scope: port_range},
+                                                        count - len(available)))
+    if len(available) < count:
+        shutdown.err('There is no available ports')
+    return available
 
 
 def get_service_port(service_id):
@@ -160,9 +242,4 @@ def get_load_balancer_services():
 
     end_point = '{}/loadbalancerservices/{}/consumedservices'.format(
         api.V1, config.LOAD_BALANCER_SVC_ID)
-    response = http_util.get(end_point)
-    if response.status_code not in range(200, 300):
-        shutdown.err(response.text)
-
-    data = json.loads(response.text)
-    return data['data']
+    return collection.get_all(end_point)
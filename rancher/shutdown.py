@@ -1,14 +1,23 @@
 """Shutdown wrapper for cli"""
 
+
+class Shutdown(SystemExit):
+    """CLI shutdown carrying its message"""
+
+    def __init__(self, code, text):
+        SystemExit.__init__(self, code)
+        self.text = text
+
+
 def err(text):
     """Shutdown with error"""
 
     print 'Error: ' + text
-    exit(2)
+    raise Shutdown(2, text)
 
 
 def info(text):
     """Normal shutdown"""
 
     print text
-    exit(0)
+    raise Shutdown(0, text)
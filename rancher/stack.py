@@ -1,34 +1,46 @@
 """Manage Stack"""
 
+import hashlib
 import json
-from time import sleep, time
-from . import shutdown, http_util, api, config
+from urllib import quote
+from . import container, shutdown, http_util, api, config, name_cache, collection, waiter
 
 
 def get_stack_id(name, no_error=False):
     """Get stack id"""
 
-    end_point = '{}/environments?limit=-1'.format(api.V1)
-    response = http_util.get(end_point)
-
-    if response.status_code not in range(200, 300):
-        shutdown.err(response.text)
+    stack_id = name_cache.get_stack_id(name)
+    if stack_id is not None:
+        return stack_id
 
-    data = json.loads(response.text)['data']
-    for environment in data:
+    for environment in __find_environments(name):
         if 'name' in environment and environment['name'] == name:
-            return environment['id'].replace('e', 'st')
+            stack_id = environment['id'].replace('e', 'st')
+            name_cache.put_stack_id(name, stack_id)
+            return stack_id
 
     if not no_error:
         shutdown.err('No such stack ' + name)
     return None
 
 
+def __find_environments(name):
+    if config.API_FILTERS:
+        end_point = '{}/environments?name={}&removed_null=1'.format(api.V1, quote(name))
+        response = collection.get_page(end_point)
+        if response.status_code in range(200, 300):
+            return collection.iterate(end_point, response)
+
+    # Full scan fallback for API servers rejecting filters
+    return collection.iterate('{}/environments'.format(api.V1))
+
+
 def remove(value_type, value):
     """Remove stack"""
 
     stack_id = None
     if value_type == 'name':
+        name_cache.invalidate_stack(value)
         stack_id = get_stack_id(value)
     elif value_type == 'id':
         stack_id = value
@@ -42,10 +54,11 @@ def remove(value_type, value):
         shutdown.err('Could not remove stack: {}'.format(response.text))
 
 
-def create(name, docker_compose_path, rancher_compose_path, stack_tags=None):
-    """Create stack"""
+def create(name, docker_compose_path, rancher_compose_path, stack_tags=None, force=False):
+    """Create stack. Existing stack is upgraded, see upgrade"""
 
     print 'Creating stack ' + name + '...'
+    name_cache.invalidate_stack(name)
     docker_compose = __get_docker_compose(docker_compose_path)
     rancher_compose = __get_rancher_compose(rancher_compose_path)
 
@@ -62,12 +75,12 @@ def create(name, docker_compose_path, rancher_compose_path, stack_tags=None):
     if response.status_code not in range(200, 300):
         if json.loads(response.text)['code'] == 'NotUnique':
             print 'Oops! Stack already exists. Let`s upgrade it...'
-            upgrade(name, docker_compose_path, rancher_compose_path)
+            upgrade(name, docker_compose_path, rancher_compose_path, force)
         else:
             shutdown.err(response.text)
     stack_id = get_stack_id(name)
-    __wait_for_active(stack_id)
-    __wait_for_healthy(stack_id)
+    resource = __wait_for_active(stack_id)
+    __wait_for_healthy(stack_id, resource)
     print 'Stack ' + name + ' created'
 
 
@@ -97,51 +110,61 @@ def __finish_upgrade(stack_id):
         shutdown.err(response.text)
 
 
-def __wait_for_upgrade(stack_id):
+def __wait_for_upgrade(stack_id, resource=None):
     print 'Let\'s wait until stack upgraded...'
+    resource = waiter.wait(lambda: __get(stack_id), 'stack upgrade',
+                           lambda stack: stack['state'] == 'upgraded',
+                           config.STACK_UPGRADE_TIMEOUT, resource,
+                           __event_ids(stack_id), __diagnoser(stack_id), check_health=False)
+    print 'Stack {} upgraded in {}s'.format(stack_id, waiter.last_duration())
+    return resource
 
-    timeout = config.STACK_UPGRADE_TIMEOUT
-    stop_time = int(time()) + timeout
-    state = None
-    while int(time()) <= stop_time:
-        state = __get_state(stack_id)
-        if state == 'upgraded':
-            print 'Stack ' + stack_id + ' upgraded'
-            return
-        sleep(5)
-    shutdown.err(
-        'Timeout while waiting to service upgrade. Current state is: ' + state)
 
-
-def __wait_for_active(stack_id):
+def __wait_for_active(stack_id, resource=None):
     print 'Let`s wait until stack become active...'
-    timeout = config.STACK_ACTIVE_TIMEOUT
-    stop_time = int(time()) + timeout
-    state = None
-    while int(time()) <= stop_time:
-        state = __get_state(stack_id)
-        if state == 'active':
-            print 'Stack ' + stack_id + ' active'
-            return
-        sleep(5)
-    shutdown.err(
-        'Timeout while waiting to service upgrade. Current state is: ' + state)
-
-
-def __wait_for_healthy(stack_id):
+    resource = waiter.wait(lambda: __get(stack_id), 'stack become active',
+                           lambda stack: stack['state'] == 'active',
+                           config.STACK_ACTIVE_TIMEOUT, resource,
+                           __event_ids(stack_id), __diagnoser(stack_id))
+    print 'Stack {} active in {}s'.format(stack_id, waiter.last_duration())
+    return resource
+
+
+def __wait_for_healthy(stack_id, resource=None):
     print 'Let`s wait until stack become healthy...'
-    timeout = config.STACK_HEALTHY_TIMEOUT
-    stop_time = int(time()) + timeout
-    health_state = None
-    while int(time()) <= stop_time:
-        health_state = __get_health_state(stack_id)
-        if health_state == 'healthy':
-            print 'Stack ' + stack_id + ' is now healthy'
-            return
-        sleep(5)
-    shutdown.err(
-        'Timeout while waiting to stack become healthy. Current health state is: ' +
-        health_state)
+    resource = waiter.wait(lambda: __get(stack_id), 'stack become healthy',
+                           lambda stack: stack['healthState'] == 'healthy',
+                           config.STACK_HEALTHY_TIMEOUT, resource,
+                           __event_ids(stack_id), __diagnoser(stack_id))
+    print 'Stack {} is now healthy in {}s'.format(stack_id, waiter.last_duration())
+    return resource
+
+
+def __diagnoser(stack_id):
+    start_counts = {}
+    return lambda resource: __diagnose(stack_id, start_counts)
+
+
+def __diagnose(stack_id, start_counts):
+    details = []
+    restarting = False
+    end_point = '{}/environments/{}/services'.format(api.V1, stack_id)
+    for svc in collection.iterate(end_point):
+        if svc.get('state') not in waiter.ERROR_STATES \
+                and svc.get('healthState') not in waiter.DEGRADED_HEALTH_STATES:
+            continue
+        details.append('service {} ({}): {}'.format(svc.get('name'), svc['id'],
+                                                    waiter.state(svc)))
+        instance_details, instances_restarting = container.diagnose_service_instances(
+            svc['id'], start_counts)
+        details.extend(instance_details)
+        restarting = restarting or instances_restarting
+    return details, restarting
+
+
+def __event_ids(stack_id):
+    # v1 environments and v2-beta stacks share the id number
+    return [stack_id, stack_id.replace('st', 'e')]
 
 
 def __get(stack_id):
@@ -152,15 +175,6 @@ def __get(stack_id):
     return json.loads(response.text)
 
 
-def __get_state(stack_id):
-    service = __get(stack_id)
-    return service['state']
-
-
-def __get_health_state(stack_id):
-    service = __get(stack_id)
-    return service['healthState']
-
 def __get_docker_compose(docker_compose_path):
     try:
         with open(docker_compose_path) as file_object:
@@ -184,11 +198,61 @@ def __get_rancher_compose(rancher_compose_path):
                     rancher_compose_path, ex.message))
 
 
-def upgrade(name, docker_compose_path, rancher_compose_path):
-    """Upgrade stack"""
+def compose_hash(docker_compose, rancher_compose):
+    """Hash of compose files content ignoring formatting, comments and key order"""
+
+    import yaml
+    digest = hashlib.sha256()
+    for text in (docker_compose, rancher_compose):
+        try:
+            data = yaml.safe_load(text or '') or {}
+            normalized = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+        except yaml.YAMLError:
+            text = text or u''
+            if isinstance(text, str):
+                # Files are read as bytes, api returns unicode
+                text = text.decode('utf-8', 'replace')
+            normalized = u'\n'.join(line.rstrip() for line in text.strip().splitlines())
+        digest.update(hashlib.sha256(normalized.encode('utf-8')).hexdigest())
+    return digest.hexdigest()
+
+
+def __deployed_compose(stack_id, stack):
+    if stack.get('dockerCompose') is not None:
+        return stack['dockerCompose'], stack.get('rancherCompose')
+    # Older servers do not keep compose on stack, export it from services
+    end_point = '{}/environments/{}/?action=exportconfig'.format(api.V1, stack_id)
+    response = http_util.post(end_point, {})
+    if response.status_code not in range(200, 300):
+        return None, None
+    config_export = json.loads(response.text)
+    return config_export.get('dockerComposeConfig'), config_export.get('rancherComposeConfig')
+
+
+def is_up_to_date(stack_id, docker_compose_path, rancher_compose_path):
+    """Stack is active and its compose matches local files"""
+
+    stack = __get(stack_id)
+    if stack.get('state') != 'active':
+        return False
+    docker_compose, rancher_compose = __deployed_compose(stack_id, stack)
+    if docker_compose is None:
+        return False
+    return compose_hash(docker_compose, rancher_compose) == compose_hash(
+        __get_docker_compose(docker_compose_path),
+        __get_rancher_compose(rancher_compose_path))
+
+
+def upgrade(name, docker_compose_path, rancher_compose_path, force=False):
+    """Upgrade stack. Skipped when it runs the same compose unless forced"""
 
     stack_id = get_stack_id(name)
+    if not force and is_up_to_date(stack_id, docker_compose_path, rancher_compose_path):
+        print 'Stack {} compose is not changed, skipping upgrade'.format(name)
+        return
     __init_upgrade(name, docker_compose_path, rancher_compose_path)
+    # Compose changes may remove services or recreate them with new ids
+    name_cache.invalidate_stack(name)
     __wait_for_upgrade(stack_id)
     __finish_upgrade(stack_id)
     __wait_for_healthy(stack_id)
@@ -0,0 +1,184 @@
+"""Api request and wait span records.
+
+Enabled by config.TRACE_FILE (JSON lines, written as records come),
+config.TRACE_SUMMARY (table on stderr by report()) and
+config.TRACE_PROMETHEUS_FILE (textfile collector metrics written by report())"""
+
+import json
+import os
+import re
+import sys
+import threading
+from time import time
+from . import config
+
+_ID = re.compile('^[0-9]+[a-z]+[0-9]+$')
+
+_STARTED = time()
+_LOCK = threading.Lock()
+_RECORDS = []
+_FILE = {}
+
+
+def enabled():
+    """Any trace output is configured"""
+    return bool(config.TRACE_FILE or config.TRACE_SUMMARY or config.TRACE_PROMETHEUS_FILE)
+
+
+def endpoint(url):
+    """Endpoint template of url: api path with ids and query values stripped"""
+
+    if url.startswith(config.RANCHER_BASE_URL or '\0'):
+        url = url[len(config.RANCHER_BASE_URL):]
+    path, _, query = url.partition('?')
+    template = '/'.join('{id}' if _ID.match(part) else part for part in path.strip('/').split('/'))
+    if query:
+        names = sorted(set(param.partition('=')[0] for param in query.split('&')))
+        template += '?' + '&'.join(names)
+    return template
+
+
+def __add(record):
+    record['start'] = round(record['start'] - _STARTED, 6)
+    with _LOCK:
+        _RECORDS.append(record)
+        if config.TRACE_FILE:
+            if 'file' not in _FILE:
+                _FILE['file'] = open(config.TRACE_FILE, 'a')
+            _FILE['file'].write(json.dumps(record, sort_keys=True) + '\n')
+            _FILE['file'].flush()
+
+
+def request(method, url, status, bytes_in, bytes_out, start, timings):
+    """Record api request. timings are dns, connect, ttfb and total seconds"""
+
+    record = {'type': 'request', 'method': method.upper(), 'endpoint': endpoint(url),
+              'status': status, 'bytesIn': bytes_in, 'bytesOut': bytes_out, 'start': start}
+    record.update((name, round(value, 6)) for name, value in timings.items())
+    __add(record)
+
+
+def span(name, start, seconds, sleep=0.0):
+    """Record wait phase span with seconds spent sleeping between polls"""
+    __add({'type': 'span', 'name': name, 'start': start, 'seconds': round(seconds, 6),
+           'sleep': round(sleep, 6)})
+
+
+def records():
+    """Copy of records so far"""
+    with _LOCK:
+        return list(_RECORDS)
+
+
+def summary():
+    """Per endpoint request totals and overall api/wait/wall seconds"""
+
+    endpoints = {}
+    totals = {'requests': 0, 'errors': 0, 'api': 0.0, 'wait': 0.0, 'sleep': 0.0,
+              'bytesIn': 0, 'bytesOut': 0, 'wall': time() - _STARTED}
+    for record in records():
+        if record['type'] == 'span':
+            totals['wait'] += record['seconds']
+            totals['sleep'] += record['sleep']
+            continue
+        key = '{} {}'.format(record['method'], record['endpoint'])
+        item = endpoints.setdefault(key, {'count': 0, 'errors': 0, 'bytesIn': 0,
+                                          'bytesOut': 0, 'times': []})
+        failed = record['status'] is None or record['status'] >= 400
+        item['count'] += 1
+        item['errors'] += 1 if failed else 0
+        item['bytesIn'] += record['bytesIn']
+        item['bytesOut'] += record['bytesOut']
+        item['times'].append(record['total'])
+        totals['requests'] += 1
+        totals['errors'] += 1 if failed else 0
+        totals['api'] += record['total']
+        totals['bytesIn'] += record['bytesIn']
+        totals['bytesOut'] += record['bytesOut']
+    return endpoints, totals
+
+
+def __write_summary(stream):
+    endpoints, totals = summary()
+    stream.write('{:<60} {:>6} {:>6} {:>10} {:>9} {:>9} {:>9}\n'.format(
+        'endpoint', 'count', 'errors', 'bytes in', 'avg', 'max', 'total'))
+    for key, item in sorted(endpoints.items(), key=lambda pair: -sum(pair[1]['times'])):
+        stream.write('{:<60} {:>6} {:>6} {:>10} {:>7.0f}ms {:>7.0f}ms {:>7.0f}ms\n'.format(
+            key[:60], item['count'], item['errors'], item['bytesIn'],
+            sum(item['times']) / item['count'] * 1000, max(item['times']) * 1000,
+            sum(item['times']) * 1000))
+    stream.write('requests: {requests}, errors: {errors}, api: {api:.3f}s, '
+                 'waiting: {wait:.3f}s (sleeping {sleep:.3f}s), wall: {wall:.3f}s\n'
+                 .format(**totals))
+
+
+def __label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def __resilience_lines():
+    from . import resilience
+    stats = resilience.stats()
+    lines = []
+    for name, metric in (('retries', 'api_retries_total'), ('limited', 'api_rate_limited_total'),
+                         ('shortCircuited', 'api_short_circuited_total'),
+                         ('circuitOpened', 'api_circuit_opened_total'),
+                         ('failed', 'api_failed_total')):
+        lines.append('# TYPE rancher_cli_{} counter'.format(metric))
+        lines.append('rancher_cli_{} {}'.format(metric, stats[name]))
+    lines.append('# TYPE rancher_cli_api_circuit_open gauge')
+    lines.append('rancher_cli_api_circuit_open {}'.format(int(stats['circuit'] != 'closed')))
+    return lines
+
+
+def __write_prometheus(path):
+    lines = []
+    counts = {}
+    seconds = {}
+    transferred = {'in': 0, 'out': 0}
+    waits = {}
+    for record in records():
+        if record['type'] == 'span':
+            waits[record['name']] = waits.get(record['name'], 0.0) + record['seconds']
+            continue
+        key = (record['method'], record['endpoint'], record['status'])
+        counts[key] = counts.get(key, 0) + 1
+        seconds[key[:2]] = seconds.get(key[:2], 0.0) + record['total']
+        transferred['in'] += record['bytesIn']
+        transferred['out'] += record['bytesOut']
+
+    lines.append('# TYPE rancher_cli_api_requests_total counter')
+    for (method, name, status), count in sorted(counts.items()):
+        lines.append('rancher_cli_api_requests_total{{method="{}",endpoint="{}",status="{}"}} {}'
+                     .format(method, __label(name), status or 'error', count))
+    lines.append('# TYPE rancher_cli_api_request_seconds_total counter')
+    for (method, name), total in sorted(seconds.items()):
+        lines.append('rancher_cli_api_request_seconds_total{{method="{}",endpoint="{}"}} {:.6f}'
+                     .format(method, __label(name), total))
+    lines.append('# TYPE rancher_cli_api_bytes_total counter')
+    for direction, total in sorted(transferred.items()):
+        lines.append('rancher_cli_api_bytes_total{{direction="{}"}} {}'.format(direction, total))
+    lines.append('# TYPE rancher_cli_wait_seconds gauge')
+    for name, total in sorted(waits.items()):
+        lines.append('rancher_cli_wait_seconds{{phase="{}"}} {:.6f}'.format(__label(name), total))
+    lines.extend(__resilience_lines())
+    lines.append('# TYPE rancher_cli_wall_seconds gauge')
+    lines.append('rancher_cli_wall_seconds {:.6f}'.format(time() - _STARTED))
+
+    # Collector may read any time, so replace the file at once
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as output:
+        output.write('\n'.join(lines) + '\n')
+    os.rename(tmp_path, path)
+
+
+def report():
+    """Write summary table and prometheus file if configured"""
+
+    if config.TRACE_SUMMARY:
+        __write_summary(sys.stderr)
+    if config.TRACE_PROMETHEUS_FILE:
+        __write_prometheus(config.TRACE_PROMETHEUS_FILE)
+    with _LOCK:
+        if 'file' in _FILE:
+            _FILE.pop('file').close()
@@ -0,0 +1,154 @@
+"""Wait for Rancher resource state transitions.
+Follows resource.change events when enabled, otherwise polls quickly at first
+and backs off with jitter up to MAX_DELAY seconds"""
+
+import random
+import threading
+from time import sleep, time
+from . import shutdown, config, trace, memo
+
+INITIAL_DELAY = 0.5
+# Finished phase is noticed within 5s even after long waits
+MAX_DELAY = 5.0
+BACKOFF = 1.5
+
+ERROR_STATES = ('error', 'erroring')
+DEGRADED_HEALTH_STATES = ('unhealthy', 'degraded')
+# Seconds between restart checks of degraded resources, rolling upgrades stay degraded
+RESTART_CHECK_INTERVAL = 30.0
+
+# Finished phases: {'phase': name, 'seconds': duration}
+PHASES = []
+_LAST = threading.local()
+
+
+def state(resource):
+    """Resource state and health state line"""
+    return 'state is: {}, health state is: {}'.format(
+        resource.get('state'), resource.get('healthState'))
+
+
+def wait(fetch, phase, condition, timeout, resource=None, resource_ids=None, diagnose=None,
+         check_health=True):
+    """Wait until condition(resource) holds and return the resource.
+    With events enabled, changes of resource_ids are taken from the event stream
+    and polling is only a fallback. Already fetched resource (optional) is
+    checked first without a request. Terminal and long degraded states abort
+    right away, diagnose(resource) returns their details and restart loop flag.
+    Upgrades start from any health, so their waits pass check_health=False and
+    abort on terminal states only"""
+
+    start = time()
+    stop_time = start + float(timeout)
+    unhealthy = {}
+    slept = {'seconds': 0.0}
+
+    def check(resource):
+        __check_failed(phase, resource, diagnose, unhealthy, check_health)
+
+    # Polls must see fresh state, not responses memoized earlier in the action
+    with memo.bypass():
+        if resource_ids and __events_available() and (resource is None or
+                                                      not condition(resource)):
+            resource = __wait_events(fetch, condition, check, stop_time, resource,
+                                     resource_ids)
+        if resource is None:
+            resource = fetch()
+        resource = __wait_polling(fetch, phase, condition, check, stop_time, resource, slept)
+
+    _LAST.seconds = round(time() - start, 3)
+    PHASES.append({'phase': phase, 'seconds': _LAST.seconds})
+    if trace.enabled():
+        trace.span(phase, start, time() - start, slept['seconds'])
+    return resource
+
+
+def __check_failed(phase, resource, diagnose, unhealthy, check_health):
+    reason = None
+    if resource.get('state') in ERROR_STATES:
+        reason = 'state is ' + resource['state']
+
+    if check_health and resource.get('healthState') == 'unhealthy':
+        unhealthy.setdefault('since', time())
+        if time() - unhealthy['since'] > float(config.UNHEALTHY_GRACE):
+            reason = 'unhealthy for more than {}s'.format(config.UNHEALTHY_GRACE)
+    else:
+        unhealthy.pop('since', None)
+
+    details = []
+    if diagnose is not None and (reason is not None or (
+            check_health and __restart_check_due(resource, unhealthy))):
+        details, restarting = diagnose(resource)
+        if restarting and reason is None:
+            reason = 'instances are restarting'
+    if reason is not None:
+        shutdown.err('Failed while waiting for {}: {}. Current {}{}'.format(
+            phase, reason, state(resource), ''.join('\n' + line for line in details)))
+
+
+def __restart_check_due(resource, unhealthy):
+    if resource.get('healthState') not in DEGRADED_HEALTH_STATES:
+        return False
+    now = time()
+    # First check records instance start counts, later ones compare
+    if now - unhealthy.get('checked', 0.0) < RESTART_CHECK_INTERVAL:
+        return False
+    unhealthy['checked'] = now
+    return True
+
+
+def __wait_polling(fetch, phase, condition, check, stop_time, resource, slept):
+    delay = INITIAL_DELAY
+    while not condition(resource):
+        check(resource)
+        remaining = stop_time - time()
+        if remaining <= 0:
+            shutdown.err('Timeout while waiting for {}. Current {}'.format(
+                phase, state(resource)))
+        pause = min(random.uniform(delay / 2, delay), remaining)
+        sleep(pause)
+        slept['seconds'] += pause
+        delay = min(delay * BACKOFF, MAX_DELAY)
+        resource = fetch()
+    return resource
+
+
+def __events_available():
+    # Event stream client (websocket) is loaded only when asked for
+    if not config.WAIT_EVENTS:
+        return False
+    from . import events
+    return events.available()
+
+
+def __wait_events(fetch, condition, check, stop_time, resource, resource_ids):
+    """Returns last seen resource. Falls back to polling when stream drops"""
+
+    from . import events
+
+    try:
+        subscription = events.Subscription(resource_ids)
+    except events.EventsError:
+        return resource
+    try:
+        # Subscribed first, so a transition between fetch and subscribe is not lost
+        resource = fetch()
+        while not condition(resource):
+            check(resource)
+            remaining = stop_time - time()
+            if remaining <= 0:
+                break
+            changed = subscription.next_resource(
+                min(remaining, float(config.EVENTS_POLL_INTERVAL)))
+            # Nothing happened for a while, so recheck in case an event was missed
+            resource = changed if changed is not None else fetch()
+    except events.EventsError:
+        pass
+    finally:
+        subscription.close()
+    return resource
+
+
+def last_duration():
+    """Duration of last phase finished by current thread in seconds"""
+    return getattr(_LAST, 'seconds', 0)
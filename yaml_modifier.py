@@ -3,16 +3,6 @@
 import argparse
 import yaml
 
-parser = argparse.ArgumentParser(description='Yaml values modifier')
-parser.add_argument('file', help='Path to file')
-parser.add_argument('prop', help='FQDN property path')
-parser.add_argument('value', help='property value')
-
-try:
-    parser.parse_args()
-except SystemExit:
-    parser.parse_args(['-h'])
-
 
 def parse(yml_file):
     with open(yml_file, 'r') as data:
@@ -23,12 +13,6 @@ def parse(yml_file):
             exit(2)
 
 
-args = parser.parse_args()
-
-parsed_yml = parse(args.file)
-prop_path = args.prop.split('.')
-
-
 def get_from_dict(data_dict, map_list):
     return reduce(lambda d, k: d[k], map_list, data_dict)
 
@@ -43,6 +27,40 @@ def set_in_dict(data_ict, map_ist, value):
     get_from_dict(data_ict, map_ist[:-1])[map_ist[-1]] = value
 
 
-set_in_dict(parsed_yml, prop_path, args.value)
-stream = file(args.file, 'w')
-yaml.dump(parsed_yml, stream)
+def modify(args):
+    parsed_yml = parse(args.file)
+    prop_path = args.prop.split('.')
+    set_in_dict(parsed_yml, prop_path, args.value)
+    stream = file(args.file, 'w')
+    yaml.dump(parsed_yml, stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Yaml values modifier')
+    parser.add_argument('file', help='Path to file')
+    parser.add_argument('prop', help='FQDN property path')
+    parser.add_argument('value', help='property value')
+    parser.add_argument('--profile', action='store_true',
+                        help='run under profiler, write profile to --profileFile and print top '
+                        'functions')
+    parser.add_argument('--profileFile', default='yaml-modifier.prof',
+                        help='profile output file. Default yaml-modifier.prof')
+    parser.add_argument('--profiler', default='cprofile', choices=('cprofile', 'sample'),
+                        help='cprofile writes pstats, sample writes collapsed stacks. '
+                        'Default cprofile')
+
+    try:
+        parser.parse_args()
+    except SystemExit:
+        parser.parse_args(['-h'])
+
+    args = parser.parse_args()
+    if args.profile:
+        from rancher import profiler
+        profiler.run(lambda: modify(args), args.profileFile, args.profiler)
+    else:
+        modify(args)
+
+
+if __name__ == '__main__':
+    main()